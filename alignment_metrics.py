@@ -0,0 +1,64 @@
+import numpy as np
+import cv2
+
+# 画像を scale 倍に縮小する関数（面積平均、scale >= 1 の場合はそのまま）
+def downsample(img, scale):
+    if scale >= 1:
+        return img
+    height, width = img.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+# 正規化相互相関（1: 完全に一致, 画像が一様な場合は 0）
+def ncc(a, b):
+    a = a - a.mean()
+    b = b - b.mean()
+    denom = np.sqrt(np.sum(a * a) * np.sum(b * b))
+    if denom == 0:
+        return 0.0
+    return float(np.sum(a * b) / denom)
+
+# 平均二乗誤差
+def mse(a, b):
+    return float(np.mean((a - b) ** 2))
+
+# 残差エネルギー（差分の二乗和を基準画像の平均を除いた二乗和で正規化した値、0: 完全に一致）
+def residual_energy(reference, aligned):
+    ref = reference - reference.mean()
+    denom = np.sum(ref * ref)
+    if denom == 0:
+        return 0.0
+    return float(np.sum((aligned - reference) ** 2) / denom)
+
+# 変位場 (高さ, 幅, 2) のヤコビアン行列式を返す関数（成分は x, y の順、単位は画素）
+# 値が 0 以下の画素は変形が折り返しており（folding）、位置合わせが破綻している
+# spacing: 変位場の1画素あたりの元画像の画素数（縮小した変位場の場合）
+def jacobian_determinant(field, spacing=1.0):
+    ux, uy = field[..., 0], field[..., 1]
+    dux_dy, dux_dx = np.gradient(ux, spacing)
+    duy_dy, duy_dx = np.gradient(uy, spacing)
+    return (1 + dux_dx) * (1 + duy_dy) - dux_dy * duy_dx
+
+# 位置合わせ結果の品質指標を計算する関数
+# reference, aligned, moving: 基準画像・位置合わせ後・位置合わせ前（ヒストグラムマッチ後）の画像 (高さ, 幅) float
+# field: 変位場 (高さ, 幅, 2)
+# scale: 指標を計算する際の縮小率, roi: (x0, y0, x1, y1) 指標を計算する範囲（画像の座標）
+def compute_alignment_metrics(reference, aligned, moving, field, scale=1.0, roi=None):
+    if roi:
+        x0, y0, x1, y1 = roi
+        reference, aligned, moving = (img[y0:y1, x0:x1] for img in (reference, aligned, moving))
+        field = field[y0:y1, x0:x1]
+    reference, aligned, moving = (
+        downsample(img.astype(np.float32), scale) for img in (reference, aligned, moving))
+    field = np.stack([downsample(field[..., c].astype(np.float32), scale) for c in range(2)], axis=-1)
+    jacobian = jacobian_determinant(field, spacing=1 / scale if scale < 1 else 1.0)
+    return {
+        'ncc': ncc(reference, aligned),
+        'mse': mse(reference, aligned),
+        'residual_energy': residual_energy(reference, aligned),
+        'ncc_before': ncc(reference, moving),
+        'mse_before': mse(reference, moving),
+        'jacobian_min': float(jacobian.min()),
+        'jacobian_max': float(jacobian.max()),
+        'folding': float(np.mean(jacobian <= 0)),
+    }
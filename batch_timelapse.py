@@ -0,0 +1,260 @@
+import os
+import json
+import argparse
+import datetime
+import concurrent.futures
+import make_timelapse
+import job_plan
+import memory_budget
+import frame_quality
+import config_schema
+import progress_events
+import cancellation
+
+# ジョブファイルでは指定できないオプション（バッチ全体で共通、またはジョブプラン用）
+BATCH_ONLY_OPTIONS = ['workers', 'max_memory', 'progress_events', 'write_plan', 'plan', 'shard', 'merge']
+
+# ジョブの設定（make_timelapse.py のオプション名をキーとする辞書）をコマンドライン引数のリストに変換する関数
+# GUI の設定と同じ caption_re_pattern / caption_re_replacement も受け付ける
+def job_argv(job):
+    actions = {action.dest: action for action in make_timelapse.parser._actions}
+    argv = []
+    for key, value in job.items():
+        if key in ('name', 'caption_re_pattern', 'caption_re_replacement'):
+            continue
+        if key in BATCH_ONLY_OPTIONS:
+            raise ValueError(f"ジョブごとには指定できないオプションです: {key}")
+        action = actions.get(key)
+        if action is None or not action.option_strings:
+            raise ValueError(f"make_timelapse.py にないオプションです: {key}")
+        flag = action.option_strings[0]
+        if value is None or value is False or value == '':
+            continue
+        if value is True:
+            argv.append(flag)
+        elif isinstance(action, argparse._AppendAction):
+            # --mask, --rendition など複数回指定するオプション
+            for item in value if isinstance(value, list) else [value]:
+                argv += [flag] + ([str(v) for v in item] if isinstance(item, list) else [str(item)])
+        elif isinstance(value, list):
+            argv += [flag] + [str(v) for v in value]
+        else:
+            argv += [flag, str(value)]
+    pattern = job.get('caption_re_pattern')
+    replacement = job.get('caption_re_replacement')
+    if pattern and replacement is not None:
+        argv += ['--caption_re', pattern, replacement]
+    return argv
+
+# ジョブの設定から make_timelapse.py の引数を作成する関数
+def job_args(job, progress=False):
+    argv = job_argv(job)
+    try:
+        args = make_timelapse.parser.parse_args(argv)
+    except SystemExit:
+        raise ValueError(f"オプションが不正です: {' '.join(argv)}")
+    if not args.ref and not args.auto_ref:
+        raise ValueError("ref または auto_ref のいずれかを指定してください。")
+    if args.rewarp and not (args.field_dir and args.ref):
+        raise ValueError("rewarp には field_dir と ref の指定が必要です。")
+    if args.temporal_smooth and not args.rewarp:
+        raise ValueError("temporal_smooth には rewarp の指定が必要です。")
+    if args.preview and args.rewarp:
+        raise ValueError("preview と rewarp は同時に指定できません。")
+    if args.preview:
+        make_timelapse.setup_preview(args)
+    args.plan_id = None
+    args.progress_events = progress
+    return args
+
+# 複数セッションのフレームをまとめて処理するためのタスク（ワーカープロセスで実行）
+# 1フレームの失敗でバッチ全体が止まらないよう、例外は失敗の結果として返す
+def run_task(task):
+    f, args = task
+    try:
+        return make_timelapse.run_frame(f, args)
+    except Exception as e:
+        return {'frame': os.path.basename(f), 'failed': True, 'error': f"{type(e).__name__}: {e}"}
+
+# フレームのメタデータをバッチレポートの1行にする関数（失敗したフレームはエラーのみ）
+def report_row(session, meta):
+    row = {'session': session['name']}
+    if meta.get('failed'):
+        row.update(frame=meta['frame'], error=meta['error'])
+        return row
+    row.update(job_plan.meta_report_row(meta))
+    row['output'] = os.path.join(session['args'].aligned_dir, meta['output'])
+    if session['args'].min_ncc is not None:
+        row['below_min_ncc'] = row['ncc'] < session['args'].min_ncc
+    return row
+
+# メイン処理
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='複数の観測セッションのタイムラプスを1つのワーカープールでまとめて作成します。')
+    parser.add_argument('jobs_file', help='ジョブファイル（JSON, make_timelapse_gui_config_schema.json の definitions/batch 形式）')
+    parser.add_argument('--workers', type=int, default=None, help='並列処理のワーカー数（ジョブファイルの指定より優先、デフォルトはCPUコア数）')
+    parser.add_argument('--max_memory', type=float, default=None, help='位置合わせに使用するメモリの上限（GB、ジョブファイルの指定より優先）')
+    parser.add_argument('--report', type=str, default=None, help='全セッションのフレームごとの結果を保存する CSV ファイル（デフォルト: ジョブファイル名_report.csv）')
+    parser.add_argument('--progress_events', action='store_true', help='進捗イベントを JSON Lines 形式で標準出力に出力する')
+    cli_args = parser.parse_args()
+
+    # GUI などからの停止要求（SIGTERM）も Ctrl+C と同様に後始末してから終了する
+    cancellation.install_signal_handlers()
+
+    with open(cli_args.jobs_file, 'r', encoding='utf-8') as f:
+        batch = json.load(f)
+    errors = config_schema.validate(batch, config_schema.load_schema(), definition='batch')
+    if errors:
+        for error in errors:
+            print(f"ジョブファイルの内容が不正です: {error}", flush=True)
+        exit(1)
+
+    workers = cli_args.workers or batch.get('workers')
+    max_memory = cli_args.max_memory or batch.get('max_memory')
+    report_path = cli_args.report or batch.get('report') or f"{os.path.splitext(cli_args.jobs_file)[0]}_report.csv"
+
+    # ジョブごとの引数を作成（共通設定 defaults をジョブの設定で上書き）
+    sessions = []
+    for i, job in enumerate(batch['jobs']):
+        job = dict(batch.get('defaults', {}), **job)
+        name = job.get('name') or os.path.basename(os.path.normpath(job.get('input_dir', f'job{i + 1}')))
+        try:
+            args = job_args(job, progress=cli_args.progress_events)
+        except ValueError as e:
+            print(f"ジョブの設定が不正です: {name} - {e}", flush=True)
+            exit(1)
+        # 品質評価・変位場の平滑化の同時実行数もバッチ全体のワーカー数とメモリ上限から決める
+        args.workers = workers
+        args.max_memory = max_memory
+        sessions.append({'name': name, 'args': args, 'status': 'pending', 'frames': [], 'remaining': 0,
+                         'failed': [], 'movie': None, 'elapsed': None})
+
+    start_time = datetime.datetime.now()
+    print(f"実行開始: {start_time.strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
+    print(f"ジョブ数: {len(sessions)}", flush=True)
+
+    rows = []
+    movie_futures = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as movie_executor:
+            # セッションの全フレームの完了後に動画を生成する（別スレッドで実行し、その間も他のセッションの位置合わせを続ける）
+            # 失敗したフレームがあるセッションは、欠けたフレームで動画を作らないようエラーとする
+            def finish_session(session):
+                session['elapsed'] = (datetime.datetime.now() - session['started']).total_seconds()
+                if session['failed']:
+                    session['status'] = 'error'
+                    session['error'] = f"{len(session['failed'])} フレームの処理に失敗しました"
+                else:
+                    session['status'] = 'aligned' if session['args'].movie else 'done'
+                print(f"セッション完了: {session['name']} ({len(session['frames'])} フレーム, 失敗 {len(session['failed'])})", flush=True)
+                make_timelapse.write_registration_report(session['args'], session['report_frames'])
+                if cli_args.progress_events:
+                    progress_events.emit('session_finished', session=session['name'], frames=len(session['frames']),
+                                         failed=len(session['failed']))
+                if session['args'].movie and not session['failed']:
+                    movie_futures[session['name']] = movie_executor.submit(make_timelapse.make_movie, session['args'])
+
+            try:
+                # セッションごとの準備（品質評価・変位場の平滑化は、それぞれのメモリの見積もりに合わせたワーカープールで行う）
+                tasks = []
+                task_sessions = []
+                for session in sessions:
+                    args = session['args']
+                    print(f"セッション準備: {session['name']} (input_dir: {args.input_dir})", flush=True)
+                    session['started'] = datetime.datetime.now()
+                    try:
+                        make_timelapse.prepare_dirs(args)
+                        frame_infos = make_timelapse.list_input_frames(args)
+                        input_files = [info['path'] for info in frame_infos]
+                        if args.quality_check or args.auto_ref or args.auto_crop:
+                            input_files = make_timelapse.assess_frames(args, input_files, frame_infos)
+                        if args.preview:
+                            input_files = make_timelapse.select_preview_frames(input_files, args.preview_frames)
+                        session['report_frames'] = input_files
+                        input_files = make_timelapse.check_frames(args, input_files, frame_infos)
+                        session['frame_bytes'] = make_timelapse.estimate_memory(args)
+                        make_timelapse.smooth_displacement_fields(args, session['report_frames'], input_files)
+                    except Exception as e:
+                        # 壊れた入力ファイルなどで準備に失敗したセッションのみをスキップする
+                        print(f"エラー: セッション {session['name']} をスキップします。理由: {e}", flush=True)
+                        session['status'] = 'error'
+                        session['error'] = str(e)
+                        continue
+                    session['frames'] = input_files
+                    session['remaining'] = len(input_files)
+                    tasks += [(f, args) for f in input_files]
+                    task_sessions += [session] * len(input_files)
+                    print(f"  対象フレーム数: {len(input_files)}", flush=True)
+
+                # 全セッションのフレームを1つのキューにまとめ、セッションの切れ目でもワーカーが空かないようにする
+                # メモリの見積もりは最も大きいセッションに合わせ、ワーカー数は予算から決めた同時実行数とする
+                active = [s for s in sessions if s['status'] != 'error']
+                frame_bytes = max((s['frame_bytes'] for s in active), default=0)
+                budget = memory_budget.memory_budget(max_memory)
+                max_inflight = memory_budget.max_concurrency(workers or os.cpu_count() or 1, max(frame_bytes, 1), budget)
+                print(f"全フレーム数: {len(tasks)}, 同時実行数: {max_inflight}", flush=True)
+                if cli_args.progress_events:
+                    progress_events.emit('run_started', total=len(tasks), max_inflight=max_inflight, sessions=len(active))
+                    progress_events.emit('stage', name='registration', frames=len(tasks))
+
+                for session in active:
+                    if session['remaining'] == 0:
+                        finish_session(session)
+
+                def on_done(index, meta):
+                    session = task_sessions[index]
+                    rows.append(report_row(session, meta))
+                    if meta.get('failed'):
+                        print(f"エラー: セッション {session['name']} の {meta['frame']} を処理できませんでした。理由: {meta['error']}", flush=True)
+                        session['failed'].append(meta['frame'])
+                    session['remaining'] -= 1
+                    if session['remaining'] == 0:
+                        finish_session(session)
+
+                if tasks:
+                    with make_timelapse.worker_pool(max_inflight) as executor:
+                        memory_budget.run_scheduled(
+                            executor, run_task, tasks, max_inflight, frame_bytes, budget, on_done=on_done)
+
+                # 動画の生成の完了を待つ
+                for session in active:
+                    future = movie_futures.get(session['name'])
+                    if future is None:
+                        continue
+                    try:
+                        session['movie'] = future.result()
+                        session['status'] = 'done'
+                    except Exception as e:
+                        print(f"エラー: セッション {session['name']} の動画を生成できませんでした。理由: {e}", flush=True)
+                        session['status'] = 'movie_error'
+                        session['error'] = str(e)
+            except KeyboardInterrupt:
+                # 動画の生成を直ちに終了する（実行中のフレームのワーカーは worker_pool が終了させる。完了済みのフレームは保存済み）
+                movie_executor.shutdown(wait=False, cancel_futures=True)
+                cancellation.terminate_children()
+                raise
+    except KeyboardInterrupt:
+        print("処理を中断しました。完了したフレームは保存済みです。ジョブに \"resume\": true を指定して再実行すると続きから処理します。", flush=True)
+        if cli_args.progress_events:
+            progress_events.emit('run_cancelled')
+        exit(1)
+    finally:
+        if rows:
+            frame_quality.write_report(report_path, rows)
+            print(f"バッチレポートを保存しました: {report_path}", flush=True)
+
+    # セッションごとの結果
+    print("結果:", flush=True)
+    for session in sessions:
+        elapsed = f"{session['elapsed']:.1f} 秒" if session['elapsed'] is not None else '-'
+        detail = session.get('error') or session['movie'] or ''
+        print(f"  {session['name']}: {session['status']}, {len(session['frames'])} フレーム, 位置合わせ {elapsed} {detail}", flush=True)
+
+    end_time = datetime.datetime.now()
+    print(f"実行終了: {end_time.strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
+    elapsed_time = end_time - start_time
+    print(f"実行時間: {str(elapsed_time)}", flush=True)
+    if cli_args.progress_events:
+        progress_events.emit('run_finished', frames=len(rows), elapsed=elapsed_time.total_seconds())
+    if any(s['status'] != 'done' for s in sessions):
+        exit(1)
@@ -0,0 +1,94 @@
+import os
+import shutil
+import signal
+import subprocess
+
+# 書き込み途中のファイルを置くフォルダー名（出力フォルダーの下に作成）
+PARTIAL_DIR = '.partial'
+
+# 子プロセスの終了を待つ時間（秒）。過ぎた場合は強制終了する
+TERMINATE_TIMEOUT = 2.0
+
+# run_process で実行中の子プロセス（別スレッドから実行した場合も停止できるよう記録する）
+_children = set()
+
+# 停止要求（SIGTERM, Windows の Ctrl+Break）を KeyboardInterrupt として扱う関数
+# Ctrl+C と同じ後始末（ワーカーと子プロセスの終了）を行えるようにする
+def install_signal_handlers():
+    def handler(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, handler)
+    if hasattr(signal, 'SIGBREAK'):
+        signal.signal(signal.SIGBREAK, handler)
+
+# ワーカープロセスの初期化関数
+# 停止はメインプロセスが行うため Ctrl+C は無視し、SIGTERM は既定の動作（即時終了）に戻す
+def init_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+# 実行中のタスクも含めてワーカープロセスを終了させる関数
+# 未実行のタスクは取り消し、実行中のワーカーは終了を待たずに停止する
+def terminate_workers(executor, timeout=TERMINATE_TIMEOUT):
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+# 書き込み途中のファイルのパスを返す関数
+# 出力先と同じファイルシステムに置き、完成後に os.replace で出力先へ移動する
+# 複数のプロセス（シャード）が同じフォルダーに書き込んでも衝突しないようプロセス ID を含める
+def partial_path(path):
+    directory = os.path.join(os.path.dirname(path), PARTIAL_DIR)
+    os.makedirs(directory, exist_ok=True)
+    base_name, ext = os.path.splitext(os.path.basename(path))
+    return os.path.join(directory, f"{base_name}.{os.getpid()}{ext}")
+
+# 中断された処理の書き込み途中のファイルを削除する関数
+def clean_partial(directory):
+    shutil.rmtree(os.path.join(directory, PARTIAL_DIR), ignore_errors=True)
+
+# 子プロセスを実行し、中断・失敗した場合は子プロセスを終了させて出力途中のファイルを削除する関数
+def run_process(cmd, outputs=()):
+    process = subprocess.Popen(cmd)
+    _children.add(process)
+    try:
+        returncode = process.wait()
+    except KeyboardInterrupt:
+        stop_process(process)
+        remove_files(outputs)
+        raise
+    finally:
+        _children.discard(process)
+    if returncode != 0:
+        remove_files(outputs)
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+# 子プロセスを終了させる関数（一定時間内に終了しない場合は強制終了する）
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=TERMINATE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+# run_process で実行中のすべての子プロセスを終了させる関数
+def terminate_children():
+    for process in list(_children):
+        stop_process(process)
+
+# ファイルを削除する関数（存在しない場合は無視）
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
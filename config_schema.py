@@ -0,0 +1,90 @@
+import os
+import json
+
+# GUI の設定とバッチ処理のジョブファイルのスキーマ
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'make_timelapse_gui_config_schema.json')
+
+# スキーマの型名と Python の型の対応（簡易検証用）
+JSON_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'integer': int,
+    'number': (int, float),
+    'boolean': bool,
+    'null': type(None),
+}
+
+# スキーマを読み込む関数
+def load_schema(path=SCHEMA_FILE):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# データをスキーマで検証し、エラーメッセージのリストを返す関数（空なら問題なし）
+# definition を指定した場合は #/definitions/<definition> で検証する
+# jsonschema がインストールされていれば使用し、なければ簡易検証を行う
+def validate(data, schema, definition=None):
+    if definition:
+        # draft-07 では $ref と並ぶキーは無視されるため、ルートのまま参照先で検証できる
+        schema = dict(schema, **{'$ref': f"#/definitions/{definition}"})
+    try:
+        import jsonschema
+    except ImportError:
+        return _validate(data, schema, schema, '$')
+    validator = jsonschema.Draft7Validator(schema)
+    return [f"{_format_path(error.absolute_path)}: {error.message}" for error in validator.iter_errors(data)]
+
+def _format_path(path):
+    return '$' + ''.join(f"[{p}]" if isinstance(p, int) else f".{p}" for p in path)
+
+# "#/a/b" 形式の参照をたどる関数
+def _resolve(root, ref):
+    if not ref.startswith('#'):
+        raise ValueError(f"外部参照には対応していません: {ref}")
+    node = root
+    for part in ref.lstrip('#').strip('/').split('/'):
+        if part:
+            node = node[part]
+    return node
+
+# jsonschema がない場合の簡易検証
+# type, enum, minimum, maximum, properties, required, additionalProperties, items, $ref に対応する
+def _validate(data, schema, root, path):
+    if '$ref' in schema:
+        return _validate(data, _resolve(root, schema['$ref']), root, path)
+
+    expected = schema.get('type')
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        # bool は int のサブクラスのため、数値型としては扱わない
+        if not any(isinstance(data, JSON_TYPES[t]) and not (isinstance(data, bool) and t in ('integer', 'number'))
+                   for t in types):
+            return [f"{path}: {data!r} is not of type {expected!r}"]
+
+    errors = []
+    if 'enum' in schema and data not in schema['enum']:
+        errors.append(f"{path}: {data!r} is not one of {schema['enum']!r}")
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        if 'minimum' in schema and data < schema['minimum']:
+            errors.append(f"{path}: {data!r} is less than the minimum of {schema['minimum']!r}")
+        if 'maximum' in schema and data > schema['maximum']:
+            errors.append(f"{path}: {data!r} is greater than the maximum of {schema['maximum']!r}")
+
+    if isinstance(data, dict):
+        properties = schema.get('properties', {})
+        for key in schema.get('required', []):
+            if key not in data:
+                errors.append(f"{path}: {key!r} is a required property")
+        for key, value in data.items():
+            if key in properties:
+                errors += _validate(value, properties[key], root, f"{path}.{key}")
+            elif schema.get('additionalProperties') is False:
+                errors.append(f"{path}: additional property {key!r} is not allowed")
+            elif isinstance(schema.get('additionalProperties'), dict):
+                errors += _validate(value, schema['additionalProperties'], root, f"{path}.{key}")
+
+    if isinstance(data, list) and isinstance(schema.get('items'), dict):
+        for i, item in enumerate(data):
+            errors += _validate(item, schema['items'], root, f"{path}[{i}]")
+
+    return errors
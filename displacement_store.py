@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import cv2
+from scipy.ndimage import zoom
+
+# 変位場の保存ファイル名を返す関数（1フレーム = 1ファイルのチャンク形式）
+def field_path(field_dir, frame_path):
+    base_name = os.path.splitext(os.path.basename(frame_path))[0]
+    return os.path.join(field_dir, f"{base_name}.npz")
+
+# 変位場 (高さ, 幅, 2) を縮小・型変換して保存する関数
+# 変位量は元画像の画素単位のまま保存するため、縮小時に値のスケーリングは不要
+def save_field(path, field, scale=1, dtype='float16', reference=''):
+    height, width = field.shape[:2]
+    if scale > 1:
+        small_size = (max(1, width // scale), max(1, height // scale))
+        field = np.stack([
+            cv2.resize(field[..., c].astype(np.float32), small_size, interpolation=cv2.INTER_AREA)
+            for c in range(field.shape[-1])
+        ], axis=-1)
+    write_field(path, field, (height, width), scale=scale, dtype=dtype, reference=reference)
+
+# 保存形式の変位場（縮小済み）をそのまま書き込む関数
+# shape: 元のサイズ (高さ, 幅)
+# 中断時に壊れたファイルが残らないよう、一時ファイルに書き込んでから置き換える
+def write_field(path, field, shape, scale=1, dtype='float16', reference=''):
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        field=field.astype(dtype),
+        shape=np.array(shape),
+        scale=np.array(scale),
+        reference=np.array(reference),
+    )
+    os.replace(tmp_path, path)
+
+# 保存された変位場を拡大せずに読み込む関数
+# field（保存時の型・サイズ）, shape, scale, dtype, reference の辞書を返す
+def read_field(path):
+    with np.load(path) as data:
+        return {
+            'field': data['field'],
+            'shape': tuple(int(v) for v in data['shape']),
+            'scale': int(data['scale']),
+            'dtype': str(data['field'].dtype),
+            'reference': str(data['reference']),
+        }
+
+# 保存された変位場を読み込み、元のサイズに拡大して返す関数
+# order: 拡大時のスプライン補間の次数（1: 線形, 3: 3次スプライン）
+def load_field(path, order=3):
+    stored = read_field(path)
+    field = stored['field'].astype(np.float32)
+    height, width = stored['shape']
+    if field.shape[:2] != (height, width):
+        factors = (height / field.shape[0], width / field.shape[1])
+        field = np.stack([
+            zoom(field[..., c], factors, order=order, mode='nearest', grid_mode=True)
+            for c in range(field.shape[-1])
+        ], axis=-1)
+    return field.astype(np.float64), stored['reference']
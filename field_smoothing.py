@@ -0,0 +1,81 @@
+import os
+import math
+import numpy as np
+import displacement_store
+import memory_budget
+
+# 時間方向に平滑化した変位場の保存フォルダー名（--field_dir の下に作成）
+SMOOTHED_DIR = 'smoothed'
+
+# 平滑化した変位場の保存フォルダーを返す関数
+def smoothed_dir(field_dir):
+    return os.path.join(field_dir, SMOOTHED_DIR)
+
+# ガウス窓の半径（フレーム数）を返す関数（3σ で打ち切る）
+def window_radius(sigma):
+    return max(0, math.ceil(3 * sigma))
+
+# ガウス窓の重み（中心からのフレーム差 -radius ... radius）を返す関数
+def gaussian_weights(sigma, radius=None):
+    if radius is None:
+        radius = window_radius(sigma)
+    offsets = np.arange(-radius, radius + 1)
+    if sigma <= 0:
+        return (offsets == 0).astype(np.float64)
+    return np.exp(-0.5 * (offsets / sigma) ** 2)
+
+# 1つのワーカーが平滑化に使用するメモリを見積もる関数
+# 窓の範囲の変位場（保存時の型・サイズ）と、重み付き和・出力用の float64 の配列の合計
+def estimate_run_bytes(field_path, sigma):
+    field = displacement_store.read_field(field_path)['field']
+    window = 2 * window_radius(sigma) + 1
+    return window * field.nbytes + 3 * field.size * 8 + memory_budget.WORKER_OVERHEAD
+
+# 連続するインデックスごとにまとめる関数（ワーカーに割り当てる単位）
+# 各まとまりは count 個以下に分割し、ワーカー間で処理量をそろえる
+def split_runs(indexes, count):
+    runs = []
+    for index in sorted(indexes):
+        if runs and index == runs[-1][-1] + 1:
+            runs[-1].append(index)
+        else:
+            runs.append([index])
+    size = max(1, math.ceil(len(indexes) / max(1, count)))
+    return [run[i:i + size] for run in runs for i in range(0, len(run), size)]
+
+# 変位場を時間方向（フレーム順）にガウス窓で平滑化して保存する関数
+# sequence: 全フレームの変位場のパス（フレーム順）, indexes: 平滑化する中心フレームのインデックス
+# out_paths: 平滑化した変位場の保存先（sequence と同じ順）
+# 窓の範囲の変位場だけを保持して順に処理するため、メモリに載る変位場は最大 2×半径+1 個
+# 保存時のサイズのまま平滑化する（拡大は線形な処理のため、拡大後に平滑化しても結果は同じ）
+# 系列の端では窓からはみ出した分を除いて重みを正規化する
+def smooth_fields(sequence, out_paths, indexes, sigma):
+    radius = window_radius(sigma)
+    weights = gaussian_weights(sigma, radius)
+    window = {}
+    first = None
+    for center in sorted(indexes):
+        start = max(0, center - radius)
+        end = min(len(sequence), center + radius + 1)
+        for index in [i for i in window if i < start]:
+            del window[index]
+        for index in range(start, end):
+            if index not in window:
+                window[index] = displacement_store.read_field(sequence[index])
+                if first is None:
+                    first = window[index]
+                elif (window[index]['shape'] != first['shape'] or window[index]['scale'] != first['scale']
+                      or window[index]['reference'] != first['reference']):
+                    raise ValueError(f"変位場のサイズまたは基準画像が他のフレームと異なります: {sequence[index]}")
+
+        total = np.zeros(window[center]['field'].shape, dtype=np.float64)
+        weight_sum = 0.0
+        for index in range(start, end):
+            weight = weights[index - center + radius]
+            total += weight * window[index]['field']
+            weight_sum += weight
+        stored = window[center]
+        displacement_store.write_field(
+            out_paths[center], total / weight_sum, stored['shape'],
+            scale=stored['scale'], dtype=stored['dtype'], reference=stored['reference'])
+    return len(indexes)
@@ -0,0 +1,137 @@
+import os
+import json
+import struct
+import datetime
+from astropy.io import fits
+
+# フォルダーごとに作成するメタデータのインデックスファイル名
+INDEX_FILE = '.timelapse_index.json'
+INDEX_VERSION = 1
+
+# 対応する画像の拡張子
+IMAGE_EXTS = ('.fits', '.fit', '.png')
+
+# FITS ヘッダーの日時文字列を datetime に変換する関数（変換できない場合は None）
+# タイムゾーン付きの場合は UTC に変換してタイムゾーンなしで返す
+def parse_date_obs(text):
+    if not text:
+        return None
+    try:
+        date = datetime.datetime.fromisoformat(str(text).strip())
+    except ValueError:
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return date
+
+# 画像のサイズと観測日時を読み込む関数（画素データは読み込まない）
+def read_image_info(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ['.fits', '.fit']:
+        header = fits.getheader(path)
+        width = header.get('NAXIS1')
+        height = header.get('NAXIS2')
+        date_obs = header.get('DATE-OBS')
+    elif ext == '.png':
+        # PNG の IHDR チャンクから幅と高さを読み取る
+        with open(path, 'rb') as f:
+            head = f.read(24)
+        if len(head) < 24 or head[:8] != b'\x89PNG\r\n\x1a\n':
+            raise ValueError(f"PNG ファイルではありません: {path}")
+        width, height = struct.unpack('>II', head[16:24])
+        date_obs = None
+    else:
+        raise ValueError(f"対応していないファイル形式です: {ext}")
+    return {
+        'width': int(width) if width is not None else None,
+        'height': int(height) if height is not None else None,
+        'date_obs': str(date_obs) if date_obs else None,
+    }
+
+# インデックスファイルを読み込む関数（存在しない・壊れている場合は空）
+def load_index(directory):
+    path = os.path.join(directory, INDEX_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index.get('files', {})
+
+# インデックスファイルを保存する関数（書き込めないフォルダーの場合は保存しない）
+# 同じフォルダーを複数のプロセス（シャードなど）が同時に走査しても壊れないよう、プロセスごとの一時ファイルから置き換える
+def save_index(directory, files):
+    path = os.path.join(directory, INDEX_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'files': files}, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+# フォルダー内の画像のメタデータを返す関数
+# ファイル名・更新時刻・サイズが一致する場合はインデックスの値を使い、変更されたファイルのみヘッダーを読む
+def scan_directory(directory, exts=IMAGE_EXTS):
+    directory = os.path.abspath(directory)
+    cached = load_index(directory)
+    files = {}
+    infos = []
+    changed = False
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(tuple(exts)):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = cached.get(name)
+        if entry is None or entry.get('mtime') != stat.st_mtime or entry.get('size') != stat.st_size:
+            try:
+                entry = read_image_info(path)
+            except (OSError, ValueError) as e:
+                print(f"警告: {name} のヘッダーを読み込めませんでした。スキップします。理由: {e}", flush=True)
+                continue
+            entry['mtime'] = stat.st_mtime
+            entry['size'] = stat.st_size
+            changed = True
+        files[name] = entry
+        infos.append(dict(entry, name=name, path=path))
+    if changed or set(files) != set(cached):
+        save_index(directory, files)
+    return infos
+
+# フレームを並べ替える関数
+# sort_by='time' の場合は DATE-OBS 順（日時のないフレームはファイル名順で後ろに並べる）
+def sort_frames(infos, sort_by='time'):
+    if sort_by == 'name':
+        return sorted(infos, key=lambda i: i['name'])
+
+    def key(info):
+        date = parse_date_obs(info['date_obs'])
+        return (date is None, date or datetime.datetime.min, info['name'])
+
+    return sorted(infos, key=key)
+
+# 観測日時が指定範囲に含まれるフレームのみを返す関数（日時のないフレームは除外する）
+def filter_time_window(infos, start=None, end=None):
+    if start is None and end is None:
+        return infos
+    result = []
+    for info in infos:
+        date = parse_date_obs(info['date_obs'])
+        if date is None:
+            continue
+        if start is not None and date < start:
+            continue
+        if end is not None and date > end:
+            continue
+        result.append(info)
+    return result
+
+# 指定サイズと異なるフレームを返す関数
+def find_size_mismatches(infos, width, height):
+    return [i for i in infos if (i['width'], i['height']) != (width, height)]
@@ -0,0 +1,226 @@
+import os
+import csv
+import numpy as np
+import cv2
+from astropy.io import fits
+
+# 画像をグレースケールの float32 配列（0-1正規化）として読み込む関数
+def read_gray_float32(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ['.fits', '.fit']:
+        data = fits.getdata(path)
+        if data is None:
+            raise ValueError(f"{path} に画像データが含まれていません。")
+        img = np.nan_to_num(data).astype(np.float32)
+    elif ext == '.png':
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError(f"{path} を読み込めませんでした。")
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        img = np.nan_to_num(img.astype(np.float32))
+    else:
+        raise ValueError(f"対応していないファイル形式です: {ext}")
+    img_min = np.min(img)
+    img_max = np.max(img)
+    if img_max > img_min:
+        img = (img - img_min) / (img_max - img_min)
+    else:
+        img = np.zeros_like(img)
+    return img
+
+# 画像を縮小する関数（scale >= 1 の場合はそのまま返す）
+def downsample(img, scale):
+    if scale >= 1.0:
+        return img
+    new_w = max(1, int(round(img.shape[1] * scale)))
+    new_h = max(1, int(round(img.shape[0] * scale)))
+    return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+# 太陽面（最大の明るい領域）を検出し、円フィットの結果を返す関数
+# 見つからない場合は None を返す
+def detect_disk(img):
+    img8 = (np.clip(img, 0, 1) * 255).astype(np.uint8)
+    _, mask = cv2.threshold(img8, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+    if len(contour) < 5:
+        return None
+
+    # 最小二乗法による円フィット（Kasa法）
+    pts = contour[:, 0, :].astype(np.float64)
+    x = pts[:, 0]
+    y = pts[:, 1]
+    a = np.column_stack([x, y, np.ones_like(x)])
+    b = x ** 2 + y ** 2
+    sol, _, _, _ = np.linalg.lstsq(a, b, rcond=None)
+    cx = sol[0] / 2
+    cy = sol[1] / 2
+    radius = np.sqrt(max(sol[2] + cx ** 2 + cy ** 2, 0.0))
+    if radius <= 0:
+        return None
+
+    # 輪郭の半径方向の残差（半径に対する相対RMS）
+    radial = np.hypot(x - cx, y - cy)
+    residual = float(np.sqrt(np.mean((radial - radius) ** 2)) / radius)
+
+    # 楕円フィットの短径/長径比を真円度とする
+    (_, _), (axis_a, axis_b), _ = cv2.fitEllipse(contour)
+    roundness = float(min(axis_a, axis_b) / max(axis_a, axis_b)) if max(axis_a, axis_b) > 0 else 0.0
+
+    bx, by, bw, bh = cv2.boundingRect(contour)
+    return {
+        'cx': float(cx),
+        'cy': float(cy),
+        'radius': float(radius),
+        'residual': residual,
+        'roundness': roundness,
+        'bbox': (bx, by, bw, bh),
+        'mask': mask,
+    }
+
+# 1フレームの品質指標を計算する関数
+# scale < 1 の場合は縮小画像で評価する（座標・半径は元画像の画素単位で返す）
+def compute_frame_quality(path, scale=0.25):
+    img = read_gray_float32(path)
+    height, width = img.shape
+    small = downsample(img, scale)
+    inv_scale = width / small.shape[1]
+
+    disk = detect_disk(small)
+    if disk is not None:
+        # 縁の影響を避けるため太陽面の内側のみで評価する
+        region = cv2.erode(disk['mask'], np.ones((5, 5), np.uint8)) > 0
+        if not np.any(region):
+            region = disk['mask'] > 0
+    else:
+        region = np.ones(small.shape, dtype=bool)
+
+    # 鮮鋭度（ラプラシアンの分散）と勾配エネルギー
+    lap = cv2.Laplacian(small, cv2.CV_32F, ksize=3)
+    gx = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3)
+    sharpness = float(np.var(lap[region]))
+    gradient_energy = float(np.mean((gx * gx + gy * gy)[region]))
+
+    # 輝度統計
+    values = small[region]
+    mean = float(np.mean(values))
+    std = float(np.std(values))
+    contrast = std / mean if mean > 0 else 0.0
+
+    result = {
+        'file': os.path.basename(path),
+        'width': width,
+        'height': height,
+        'sharpness': sharpness,
+        'gradient_energy': gradient_energy,
+        'mean': mean,
+        'std': std,
+        'contrast': contrast,
+        'disk_found': disk is not None,
+        'disk_cx': None,
+        'disk_cy': None,
+        'disk_radius': None,
+        'disk_residual': None,
+        'roundness': None,
+        'disk_bbox': None,
+    }
+    if disk is not None:
+        result.update({
+            'disk_cx': disk['cx'] * inv_scale,
+            'disk_cy': disk['cy'] * inv_scale,
+            'disk_radius': disk['radius'] * inv_scale,
+            'disk_residual': disk['residual'],
+            'roundness': disk['roundness'],
+            'disk_bbox': tuple(int(round(v * inv_scale)) for v in disk['bbox']),
+        })
+    return result
+
+# セッション全体の品質指標から除外するフレームを判定する関数
+# 鮮鋭度はセッションの中央値に対する相対値で評価する
+# keep に含まれるファイル（基準画像など）は除外しない
+def evaluate_quality(scores, min_sharpness=0.5, max_disk_residual=0.03, keep=()):
+    sharp_values = [s['sharpness'] for s in scores if s['disk_found']]
+    median_sharp = float(np.median(sharp_values)) if sharp_values else 0.0
+
+    for s in scores:
+        s['sharpness_rel'] = s['sharpness'] / median_sharp if median_sharp > 0 else 0.0
+        reasons = []
+        if not s['disk_found']:
+            reasons.append('no_disk')
+        else:
+            if s['sharpness_rel'] < min_sharpness:
+                reasons.append('blur')
+            if s['disk_residual'] > max_disk_residual:
+                reasons.append('disk_shape')
+        if s['file'] in keep:
+            reasons = []
+        s['rejected'] = bool(reasons)
+        s['reason'] = ';'.join(reasons)
+    return scores
+
+# 基準画像に最も適したフレームを選択する関数
+# スコア = 相対鮮鋭度 × 真円度 × (1 - 円フィット残差 / 残差上限)
+# 除外判定されていないフレームから選び、該当がなければ太陽面が検出できたフレームから選ぶ
+def select_reference(scores, max_disk_residual=0.03):
+    for s in scores:
+        if s['disk_found']:
+            shape_term = max(0.0, 1.0 - s['disk_residual'] / max_disk_residual)
+            s['ref_score'] = s['sharpness_rel'] * s['roundness'] * shape_term
+        else:
+            s['ref_score'] = 0.0
+
+    candidates = [s for s in scores if s['disk_found'] and not s.get('rejected')]
+    if not candidates:
+        candidates = [s for s in scores if s['disk_found']]
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda s: s['ref_score'])
+    best['rejected'] = False
+    best['reason'] = ''
+    return best
+
+# 全フレームの太陽面を含む切り抜き範囲 (x0, y0, x1, y1) を基準画像の座標で返す関数
+# scores には位置合わせするフレームのみを渡す（--quality_check なしでは除外判定されたフレームも位置合わせされるため、
+# rejected は参照しない）
+# 各フレームは位置合わせ前に基準画像のサイズにリサイズされるため、その倍率で座標を変換する
+# margin を加えたうえで画像内に収め、動画のエンコードのため幅と高さを偶数にする
+def union_disk_box(scores, ref_width, ref_height, margin=0):
+    boxes = []
+    for s in scores:
+        if not s['disk_found']:
+            continue
+        x, y, w, h = s['disk_bbox']
+        sx = ref_width / s['width']
+        sy = ref_height / s['height']
+        boxes.append((x * sx, y * sy, (x + w) * sx, (y + h) * sy))
+    if not boxes:
+        return None
+
+    x0 = max(0, int(np.floor(min(b[0] for b in boxes))) - margin)
+    y0 = max(0, int(np.floor(min(b[1] for b in boxes))) - margin)
+    x1 = min(ref_width, int(np.ceil(max(b[2] for b in boxes))) + margin)
+    y1 = min(ref_height, int(np.ceil(max(b[3] for b in boxes))) + margin)
+    if (x1 - x0) % 2:
+        x1 = x1 + 1 if x1 < ref_width else x1
+        x0 = x0 + 1 if (x1 - x0) % 2 else x0
+    if (y1 - y0) % 2:
+        y1 = y1 + 1 if y1 < ref_height else y1
+        y0 = y0 + 1 if (y1 - y0) % 2 else y0
+    return x0, y0, x1, y1
+
+# 辞書のリストを CSV に書き出す関数（列は全行のキーの和集合）
+def write_report(path, rows):
+    fieldnames = []
+    for row in rows:
+        for key in row:
+            if key not in fieldnames:
+                fieldnames.append(key)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
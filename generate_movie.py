@@ -2,10 +2,11 @@ import os
 import argparse
 import cv2
 import numpy as np
-import subprocess
 import tempfile
 import re
 from astropy.io import fits
+import fits_index
+import cancellation
 
 # 画像ファイルを読み込む関数（PNG または FITS）
 def read_image(image_path):
@@ -18,7 +19,7 @@ def read_image(image_path):
             raise ValueError(f"{image_path} に画像データが含まれていません。")
         data = np.nan_to_num(data)
         if data.dtype.byteorder == '>':
-            data = data.byteswap().newbyteorder()
+            data = data.byteswap().view(data.dtype.newbyteorder())
         vmin, vmax = (0, 65535)
         data_clipped = np.clip(data, vmin, vmax)
         norm_data = cv2.normalize(data_clipped, None, 0, 255, cv2.NORM_MINMAX)
@@ -27,62 +28,183 @@ def read_image(image_path):
         raise ValueError(f"対応していないファイル形式: {image_path}")
     return frame
 
+# 動画の既定のコーデックと画質
+DEFAULT_CODEC = 'libx264'
+DEFAULT_CRF = 23
+
+# --rendition で指定できる項目と型
+RENDITION_KEYS = {
+    'width': int,
+    'height': int,
+    'crf': int,
+    'fps': int,
+    'codec': str,
+}
+
+# キャプションの描画設定
+CAPTION_FONT = cv2.FONT_HERSHEY_SIMPLEX
+CAPTION_FONT_SCALE = 1
+CAPTION_THICKNESS = 1
+CAPTION_MARGIN = 100
+# 背景サイズの文字サイズに対する倍率
+CAPTION_BG_SCALE = 1.2
+
+# キャプションの文字列を返す関数（caption_re が指定された場合は正規表現で置換）
+def caption_text(image_name, caption_re=None):
+    basename = os.path.basename(image_name)
+    if caption_re:
+        pattern, replacement = caption_re
+        basename = re.sub(pattern, replacement, basename)
+    return basename
+
+# キャプション背景の位置 (x1, y1, x2, y2) を返す関数
+# 全フレームで同じ背景を使うため、最も大きい文字列のサイズから求める
+def caption_box(frame_height, texts):
+    sizes = [cv2.getTextSize(t, CAPTION_FONT, CAPTION_FONT_SCALE, CAPTION_THICKNESS)[0] for t in texts]
+    text_width = max(w for w, _ in sizes)
+    text_height = max(h for _, h in sizes)
+    bg_width = int(text_width * CAPTION_BG_SCALE)
+    bg_height = int(text_height * CAPTION_BG_SCALE)
+    bg_x1 = CAPTION_MARGIN
+    bg_y1 = frame_height - CAPTION_MARGIN - bg_height
+    return bg_x1, bg_y1, bg_x1 + bg_width, bg_y1 + bg_height
+
+# キャプションの文字を背景の中央に描画する関数
+def draw_caption_text(frame, text, box):
+    bg_x1, bg_y1, bg_x2, bg_y2 = box
+    (text_width, text_height), _ = cv2.getTextSize(text, CAPTION_FONT, CAPTION_FONT_SCALE, CAPTION_THICKNESS)
+    text_x = bg_x1 + (bg_x2 - bg_x1 - text_width) // 2
+    text_y = bg_y1 + (bg_y2 - bg_y1 + text_height) // 2  # ベースライン調整込み
+    color = (255, 255, 255) if frame.ndim == 3 else (255,)
+    cv2.putText(frame, text, (text_x, text_y), CAPTION_FONT, CAPTION_FONT_SCALE, color, CAPTION_THICKNESS, cv2.LINE_AA)
+
+# フレームを指定サイズのキャンバスの中央に縦横比を保って配置する関数
+def fit_to_canvas(frame, canvas_size):
+    canvas_w, canvas_h = canvas_size
+    h, w = frame.shape[:2]
+    scale = min(canvas_w / w, canvas_h / h)
+    new_w = max(1, int(round(w * scale)))
+    new_h = max(1, int(round(h * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    resized = cv2.resize(frame, (new_w, new_h), interpolation=interpolation)
+    canvas = np.zeros((canvas_h, canvas_w), dtype=frame.dtype)
+    x = (canvas_w - new_w) // 2
+    y = (canvas_h - new_h) // 2
+    canvas[y:y + new_h, x:x + new_w] = resized
+    return canvas
+
+# マスク・オーバーレイ用の画像を読み込む関数
+# 戻り値: (色 (高さ, 幅, 3) float32 0-255, アルファ (高さ, 幅) float32 0-1)
+# アルファチャンネルがない画像は輝度をアルファ値とする（グレースケール画像は白で合成）
+def read_layer(path):
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"{path} を読み込めませんでした。")
+    img = img.astype(np.float32)
+    if img.max() > 255:
+        img = img / 257.0  # 16bit → 8bit 相当
+    if img.ndim == 2:
+        color = np.full(img.shape + (3,), 255, dtype=np.float32)
+        alpha = img / 255.0
+    elif img.shape[2] == 4:
+        color = img[:, :, :3]
+        alpha = img[:, :, 3] / 255.0
+    else:
+        color = img[:, :, :3]
+        alpha = cv2.cvtColor(color, cv2.COLOR_BGR2GRAY) / 255.0
+    return color, alpha
+
+# マスク・オーバーレイ・キャプション背景を1つの係数 (K, B) にまとめる関数
+# 各フレームは out = frame * K + B の1回の演算で合成できる
+# masks: 輝度マスク（白: 表示, 黒: 非表示）, overlays: read_layer の戻り値のリスト
+def build_layers(frame_shape, masks, overlays, box=None):
+    h, w = frame_shape[:2]
+    gain = np.ones((h, w), dtype=np.float32)
+    bias = np.zeros((h, w, 3), dtype=np.float32)
+    is_color = False
+
+    for mask in masks:
+        m = cv2.resize(mask, (w, h), interpolation=cv2.INTER_AREA)
+        gain *= m
+        bias *= m[:, :, np.newaxis]
+
+    for color, alpha in overlays:
+        c = cv2.resize(color, (w, h), interpolation=cv2.INTER_AREA)
+        a = cv2.resize(alpha, (w, h), interpolation=cv2.INTER_AREA)
+        bias = bias * (1.0 - a)[:, :, np.newaxis] + c * a[:, :, np.newaxis]
+        gain *= 1.0 - a
+        if not (np.array_equal(c[:, :, 0], c[:, :, 1]) and np.array_equal(c[:, :, 1], c[:, :, 2])):
+            is_color = True
+
+    # キャプション背景（黒）は一度だけ描画しておく
+    if box is not None:
+        bg_x1, bg_y1, bg_x2, bg_y2 = box
+        gain[max(bg_y1, 0):bg_y2, max(bg_x1, 0):bg_x2] = 0
+        bias[max(bg_y1, 0):bg_y2, max(bg_x1, 0):bg_x2] = 0
+
+    if is_color:
+        return gain[:, :, np.newaxis], bias
+    return gain, bias[:, :, 0].copy()
+
+# 事前計算した係数でフレームを合成する関数
+def apply_layers(frame, layers):
+    gain, bias = layers
+    out = frame.astype(np.float32)
+    if bias.ndim == 3:
+        out = out[:, :, np.newaxis]
+    out = out * gain + bias
+    return np.clip(out + 0.5, 0, 255).astype(np.uint8)
+
 # 画像から動画を生成する関数
 # --caption が指定された場合は、各フレームの左下にファイル名（ベースネーム）を描画
 # --caption_re が指定された場合は、正規表現でファイル名を置換して描画
-def create_video_with_ffmpeg(input_dir, output_file, fps=10, crf=23, caption=False, caption_re=None):
-    images = sorted([
-        img for img in os.listdir(input_dir)
-        if img.lower().endswith(('.png', '.fits', '.fit'))
-    ])
+# sort_by='time' の場合は FITS ヘッダーの DATE-OBS 順（日時のない画像はファイル名順で後ろに並べる）
+# masks / overlays が指定された場合は、各フレームにマスクとオーバーレイ画像を合成する
+# canvas が指定された場合は、フレームを (幅, 高さ) のキャンバスに配置してから合成する
+# renditions が指定された場合は、フレームの準備を1回だけ行い、追加の動画も同時に生成する
+def create_video_with_ffmpeg(input_dir, output_file, fps=10, crf=23, caption=False, caption_re=None, sort_by='name',
+                             masks=None, overlays=None, canvas=None, renditions=None):
+    infos = fits_index.sort_frames(fits_index.scan_directory(input_dir), sort_by=sort_by)
+    images = [info['name'] for info in infos]
     if not images:
         raise ValueError("指定されたフォルダに対応する画像が見つかりません。")
 
+    # マスクとオーバーレイは最初に一度だけ読み込む
+    mask_layers = []
+    for path in masks or []:
+        _, alpha = read_layer(path)
+        mask_layers.append(alpha)
+    overlay_layers = [read_layer(path) for path in overlays or []]
+    use_layers = bool(mask_layers or overlay_layers)
+    captions = [caption_text(name, caption_re) for name in images] if caption else []
+
+    # フレームサイズごとの合成係数とキャプション背景位置のキャッシュ
+    prepared = {}
+
     with tempfile.TemporaryDirectory() as temp_dir:
         for i, image_name in enumerate(images):
             image_path = os.path.join(input_dir, image_name)
             try:
                 frame = read_image(image_path)
+                if canvas:
+                    frame = fit_to_canvas(frame, canvas)
 
-                # キャプション表示が有効な場合
-                if caption:
-                    basename = os.path.basename(image_name)
-                    if caption_re:
-                        pattern, replacement = caption_re
-                        basename = re.sub(pattern, replacement, basename)
-
-                    # テキスト描画設定
-                    font = cv2.FONT_HERSHEY_SIMPLEX
-                    font_scale = 1
-                    thickness = 1
-                    color = (255,)  # 白（グレースケール）
-                    margin = 100
-
-                    # 文字サイズを取得
-                    (text_width, text_height), baseline = cv2.getTextSize(basename, font, font_scale, thickness)
-
-                    # 背景サイズを1.2倍に拡張
-                    scale = 1.2
-                    bg_width = int(text_width * scale)
-                    bg_height = int(text_height * scale)
-
-                    # 背景の左上座標（画面下部に中央配置）
-                    bg_x1 = margin
-                    bg_y1 = frame.shape[0] - margin - bg_height
-
-                    # 背景の右下座標
-                    bg_x2 = bg_x1 + bg_width
-                    bg_y2 = bg_y1 + bg_height
+                if frame.shape not in prepared:
+                    box = caption_box(frame.shape[0], captions) if caption else None
+                    layers = build_layers(frame.shape, mask_layers, overlay_layers, box) if use_layers else None
+                    prepared[frame.shape] = (box, layers)
+                box, layers = prepared[frame.shape]
 
+                if layers is not None:
+                    # キャプション背景は合成係数に含まれている
+                    frame = apply_layers(frame, layers)
+                elif caption:
                     # 黒い背景を描画
-                    cv2.rectangle(frame, (bg_x1, bg_y1), (bg_x2, bg_y2), (0,), thickness=cv2.FILLED)
+                    cv2.rectangle(frame, box[:2], box[2:], (0,), thickness=cv2.FILLED)
 
-                    # テキストの描画位置（背景の中央に配置）
-                    text_x = bg_x1 + (bg_width - text_width) // 2
-                    text_y = bg_y1 + (bg_height + text_height) // 2  # ベースライン調整込み
-
-                    # テキストを描画
-                    cv2.putText(frame, basename, (text_x, text_y), font, font_scale, color, thickness, cv2.LINE_AA)
+                # キャプション表示が有効な場合
+                if caption:
+                    draw_caption_text(frame, captions[i], box)
 
                 output_path = os.path.join(temp_dir, f"frame_{i:04d}.png")
                 cv2.imwrite(output_path, frame)
@@ -90,19 +212,69 @@ def create_video_with_ffmpeg(input_dir, output_file, fps=10, crf=23, caption=Fal
                 print(f"警告: {image_name} の読み込みに失敗しました。スキップします。理由: {e}", flush=True)
                 continue
 
-        # FFmpeg コマンドで動画生成
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-y',
-            '-framerate', str(fps),
-            '-i', os.path.join(temp_dir, 'frame_%04d.png'),
-            '-c:v', 'libx264',
-            '-crf', str(crf),
+        # FFmpeg コマンドで動画生成（追加の出力がある場合も1回の読み込みで全て生成する）
+        outputs = [{'file': output_file, 'fps': fps, 'crf': crf}] + list(renditions or [])
+        ffmpeg_cmd = build_ffmpeg_command(os.path.join(temp_dir, 'frame_%04d.png'), fps, outputs)
+        # 中断・失敗した場合は FFmpeg を終了させ、書き込み途中の動画ファイルを削除する
+        cancellation.run_process(ffmpeg_cmd, outputs=[output['file'] for output in outputs])
+        for output in outputs:
+            print(f"動画ファイルが生成されました: {output['file']}", flush=True)
+
+# FFmpeg のコマンドを組み立てる関数
+# outputs が複数の場合は split フィルターで分岐し、出力ごとにサイズ・フレームレート・画質・コーデックを設定する
+def build_ffmpeg_command(input_pattern, input_fps, outputs):
+    cmd = ['ffmpeg', '-y', '-framerate', str(input_fps), '-i', input_pattern]
+
+    if len(outputs) == 1 and not (outputs[0].get('width') or outputs[0].get('height')):
+        output = outputs[0]
+        cmd += [
+            '-c:v', output.get('codec', DEFAULT_CODEC),
+            '-crf', str(output.get('crf', DEFAULT_CRF)),
             '-pix_fmt', 'yuv420p',
-            output_file
+            output['file']
         ]
-        subprocess.run(ffmpeg_cmd, check=True)
-        print(f"動画ファイルが生成されました: {output_file}", flush=True)
+        return cmd
+
+    # [0:v] を出力数に分岐し、出力ごとにスケールと表示時刻を設定する
+    labels = [f"s{i}" for i in range(len(outputs))]
+    graph = [f"[0:v]split={len(outputs)}" + ''.join(f"[{label}]" for label in labels)]
+    for i, output in enumerate(outputs):
+        filters = []
+        if output.get('width') or output.get('height'):
+            filters.append(f"scale={output.get('width') or -2}:{output.get('height') or -2}")
+        out_fps = output.get('fps', input_fps)
+        filters.append(f"setpts=N/({out_fps}*TB)")
+        graph.append(f"[{labels[i]}]{','.join(filters)}[v{i}]")
+    cmd += ['-filter_complex', ';'.join(graph)]
+
+    for i, output in enumerate(outputs):
+        cmd += [
+            '-map', f"[v{i}]",
+            '-r', str(output.get('fps', input_fps)),
+            '-c:v', output.get('codec', DEFAULT_CODEC),
+            '-crf', str(output.get('crf', DEFAULT_CRF)),
+            '-pix_fmt', 'yuv420p',
+            output['file']
+        ]
+    return cmd
+
+# --rendition の指定（出力ファイル名と KEY=VALUE のリスト）を辞書に変換する関数
+def parse_rendition(values):
+    rendition = {'file': values[0]}
+    for item in values[1:]:
+        key, sep, value = item.partition('=')
+        if not sep or key not in RENDITION_KEYS:
+            raise ValueError(f"--rendition の指定が不正です: {item}（指定可能なキー: {', '.join(RENDITION_KEYS)}）")
+        rendition[key] = RENDITION_KEYS[key](value)
+    return rendition
+
+# "幅x高さ" 形式のサイズ指定を (幅, 高さ) に変換する関数
+def parse_size(text):
+    try:
+        width, height = (int(v) for v in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"サイズの形式が不正です（幅x高さ で指定）: {text}")
+    return width, height
 
 # メイン関数
 if __name__ == "__main__":
@@ -114,18 +286,44 @@ if __name__ == "__main__":
     parser.add_argument("--caption", action="store_true", help="各フレームの左下にファイル名を表示する")
     parser.add_argument("--caption_re", nargs=2, metavar=('PATTERN', 'REPLACEMENT'),
                         help="ファイル名の置換（正規表現）: PATTERN を REPLACEMENT に置換")
+    parser.add_argument("--sort_by", choices=["time", "name"], default="time",
+                        help="フレームの並び順（time: FITS ヘッダーの DATE-OBS 順, name: ファイル名順、デフォルト: time）")
+    parser.add_argument("--mask", action="append", default=[],
+                        help="輝度マスク画像（白: 表示, 黒: 非表示）。複数指定可")
+    parser.add_argument("--overlay", action="append", default=[],
+                        help="重ねる画像（アルファチャンネル付き PNG など）。複数指定可")
+    parser.add_argument("--canvas", type=parse_size, default=None,
+                        help="出力サイズ 幅x高さ（例: 1920x1080）。フレームを縦横比を保って中央に配置する")
+    parser.add_argument("--rendition", nargs="+", action="append", default=[], metavar=("OUTPUT", "KEY=VALUE"),
+                        help="同時に生成する追加の動画（例: --rendition out_1080.mp4 height=1080 crf=25）。"
+                             "KEY は width, height, crf, fps, codec。複数指定可")
 
     args = parser.parse_args()
+    try:
+        renditions = [parse_rendition(values) for values in args.rendition]
+    except ValueError as e:
+        parser.error(str(e))
 
     print("指定されたオプション:", flush=True)
     for arg in vars(args):
         print(f"  {arg}: {getattr(args, arg)}", flush=True)
 
-    create_video_with_ffmpeg(
-        args.input_dir,
-        args.output_file,
-        fps=args.fps,
-        crf=args.crf,
-        caption=args.caption,
-        caption_re=args.caption_re
-    )
+    # 停止要求（SIGTERM）も Ctrl+C と同様に FFmpeg を終了させてから終了する
+    cancellation.install_signal_handlers()
+    try:
+        create_video_with_ffmpeg(
+            args.input_dir,
+            args.output_file,
+            fps=args.fps,
+            crf=args.crf,
+            caption=args.caption,
+            caption_re=args.caption_re,
+            sort_by=args.sort_by,
+            masks=args.mask,
+            overlays=args.overlay,
+            canvas=args.canvas,
+            renditions=renditions
+        )
+    except KeyboardInterrupt:
+        print("動画の生成を中断しました。", flush=True)
+        exit(1)
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import datetime
+
+# ジョブプランに保存する位置合わせのパラメーター
+PLAN_PARAMS = [
+    'iterations', 'stddev', 'fast', 'multiscale', 'interpolator',
+    'field_dir', 'field_scale', 'field_dtype', 'field_order', 'rewarp', 'temporal_smooth',
+    'crop', 'preview',
+]
+
+# ジョブプランに保存する動画生成のパラメーター
+MOVIE_PARAMS = ['movie', 'fps', 'crf', 'caption', 'caption_re', 'mask', 'overlay', 'canvas', 'rendition']
+
+# フレームごとのメタデータの保存フォルダー名（aligned_dir の下に作成）
+METADATA_DIR = 'metadata'
+
+# ファイルの SHA-256 を計算する関数
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# "i/N" 形式のシャード指定を (i, N) に変換する関数（i は 0 始まり）
+def parse_shard(text):
+    try:
+        index, count = (int(v) for v in text.split('/'))
+    except ValueError:
+        raise ValueError(f"シャードの指定が不正です（i/N 形式で指定）: {text}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"シャードの指定が範囲外です（0 <= i < N）: {text}")
+    return index, count
+
+# シャードが担当するフレームを返す関数
+# 処理時間の偏りを避けるため、連続区間ではなく N 個おきに割り当てる
+def shard_frames(frames, index, count):
+    return frames[index::count]
+
+# ジョブプランに保存する動画生成のパラメーターを返す関数
+# マージは別のマシンや作業フォルダーから実行されるため、ファイルのパスは絶対パスにする
+def plan_movie_params(args):
+    params = {key: getattr(args, key) for key in MOVIE_PARAMS}
+    if params['movie']:
+        params['movie'] = os.path.abspath(params['movie'])
+    for key in ('mask', 'overlay'):
+        params[key] = [os.path.abspath(p) for p in params[key] or []]
+    # --rendition は [出力ファイル, KEY=VALUE, ...] のリスト
+    params['rendition'] = [[os.path.abspath(r[0])] + list(r[1:]) for r in params['rendition'] or []]
+    return params
+
+# ジョブプランを作成して保存する関数
+def write_plan(path, args, frames):
+    plan = {
+        'version': 1,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'reference': {
+            'path': os.path.abspath(args.ref),
+            'sha256': file_sha256(args.ref),
+        },
+        'aligned_dir': os.path.abspath(args.aligned_dir),
+        'params': {key: getattr(args, key) for key in PLAN_PARAMS},
+        'movie_params': plan_movie_params(args),
+        'frames': [os.path.abspath(f) for f in frames],
+    }
+    plan['plan_id'] = plan_id(plan)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=2, ensure_ascii=False)
+    return plan
+
+# ジョブプランの内容から識別子（ハッシュ）を計算する関数
+def plan_id(plan):
+    content = {key: plan[key] for key in ('reference', 'aligned_dir', 'params', 'frames')}
+    text = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+# ジョブプランを読み込む関数（内容が改変されていないかも確認する）
+def load_plan(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get('plan_id') != plan_id(plan):
+        raise ValueError(f"ジョブプランの内容が識別子と一致しません: {path}")
+    return plan
+
+# ジョブプランのパラメーターを args に反映する関数
+def apply_plan(plan, args):
+    for key, value in plan['params'].items():
+        setattr(args, key, value)
+    # 動画ファイル名はマージ時の指定を優先する
+    for key, value in plan['movie_params'].items():
+        if key == 'movie' and args.movie:
+            continue
+        setattr(args, key, value)
+    args.ref = plan['reference']['path']
+    args.aligned_dir = plan['aligned_dir']
+    args.plan_id = plan['plan_id']
+
+# フレームのメタデータのパスを返す関数
+def frame_meta_path(aligned_dir, frame_path):
+    base_name = os.path.splitext(os.path.basename(frame_path))[0]
+    return os.path.join(aligned_dir, METADATA_DIR, f"{base_name}.json")
+
+# フレームのメタデータを保存する関数
+# メタデータはフレームの完了記録を兼ねるため、一時ファイルに書き込んでから置き換える
+def write_frame_meta(aligned_dir, frame_path, meta):
+    path = frame_meta_path(aligned_dir, frame_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# フレームのメタデータを読み込む関数（存在しない場合は None）
+def read_frame_meta(aligned_dir, frame_path):
+    path = frame_meta_path(aligned_dir, frame_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# フレームのメタデータをレポート（CSV）の1行にする関数
+def meta_report_row(meta):
+    row = {'frame': meta['frame'], 'output': meta['output'], 'elapsed': meta['elapsed']}
+    for key, value in meta['displacement'].items():
+        row[f'displacement_{key}'] = value
+    for key, value in meta.get('metrics', {}).items():
+        row[key] = value
+    for key, value in meta.get('timings', {}).items():
+        row[f'time_{key}'] = value
+    return row
+
+# フレームが同じ条件で処理済みか確認する関数（処理済みなら None、そうでなければ理由を返す）
+# params を指定した場合は位置合わせのパラメーターも一致することを確認する
+def frame_status(aligned_dir, frame_path, reference_sha256, plan_id=None, params=None):
+    meta = read_frame_meta(aligned_dir, frame_path)
+    if meta is None:
+        return 'missing'
+    if meta.get('plan_id') != plan_id:
+        return 'plan_mismatch'
+    if meta.get('reference_sha256') != reference_sha256:
+        return 'reference_mismatch'
+    if params is not None and meta.get('params') != params:
+        return 'params_mismatch'
+    if not os.path.exists(os.path.join(aligned_dir, meta['output'])):
+        return 'output_missing'
+    return None
+
+# ジョブプランの全フレームが処理済みか検証する関数
+# 問題のあるフレームと理由のリストを返す（空なら完了）
+def verify_plan(plan):
+    problems = []
+    if file_sha256(plan['reference']['path']) != plan['reference']['sha256']:
+        problems.append((plan['reference']['path'], 'reference_changed'))
+    for frame in plan['frames']:
+        reason = frame_status(plan['aligned_dir'], frame, plan['reference']['sha256'], plan_id=plan['plan_id'])
+        if reason:
+            problems.append((frame, reason))
+    return problems
@@ -7,8 +7,21 @@ import argparse
 import SimpleITK as sitk
 import concurrent.futures
 import datetime
-import subprocess
+import time
+import platform
+import functools
+import collections
+import contextlib
 from scipy.ndimage import zoom
+import frame_quality
+import displacement_store
+import job_plan
+import memory_budget
+import fits_index
+import progress_events
+import cancellation
+import alignment_metrics
+import field_smoothing
 
 # FITSファイルをSimpleITKのfloat32画像に変換する関数
 def fits_to_sitk_float32(path):
@@ -31,15 +44,52 @@ def load_reference_image(path):
     else:
         raise ValueError(f"対応していないファイル形式です: {ext}")
 
+# コマンドラインで指定された日時を変換する関数
+def parse_time_arg(text):
+    date = fits_index.parse_date_obs(text)
+    if date is None:
+        raise argparse.ArgumentTypeError(f"日時の形式が不正です: {text}")
+    return date
+
+# コマンドラインで指定された切り抜き範囲 "X0,Y0,X1,Y1" を変換する関数
+def parse_crop_arg(text):
+    try:
+        x0, y0, x1, y1 = (int(v) for v in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"切り抜き範囲の形式が不正です（X0,Y0,X1,Y1 で指定）: {text}")
+    if x1 <= x0 or y1 <= y0:
+        raise argparse.ArgumentTypeError(f"切り抜き範囲が不正です: {text}")
+    return [x0, y0, x1, y1]
+
+# コマンドラインで指定されたプレビューの縮小率を変換する関数
+def parse_preview_arg(text):
+    try:
+        scale = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"縮小率の形式が不正です: {text}")
+    if not 0 < scale <= 1:
+        raise argparse.ArgumentTypeError(f"縮小率は 0 より大きく 1 以下で指定してください: {text}")
+    return scale
+
+# 位置合わせ後のリサンプリングに使用する補間方法
+INTERPOLATORS = {
+    'linear': sitk.sitkLinear,
+    'bspline': sitk.sitkBSpline,
+    'nearest': sitk.sitkNearestNeighbor,
+    'lanczos': sitk.sitkLanczosWindowedSinc,
+}
+
 # コマンドライン引数の定義
 parser = argparse.ArgumentParser(description='Sol\'Ex画像の歪み補正タイムラプス作成')
-parser.add_argument('--ref', type=str, required=True, help='基準となるモノクロ画像（fits, fit, png）のファイルのパス')
+parser.add_argument('--ref', type=str, default=None, help='基準となるモノクロ画像（fits, fit, png）のファイルのパス')
+parser.add_argument('--auto_ref', action='store_true', help='入力画像から基準画像を自動選択する（鮮鋭度と真円度で評価）')
 parser.add_argument('--input_dir', type=str, default='./input', help='入力画像ファイル（fits, fit, png）のフォルダー')
 parser.add_argument('--aligned_dir', type=str, default='./aligned', help='位置合わせ後画像の保存フォルダー')
 parser.add_argument('--movie', type=str, default=None, help='動画の出力ファイル名')
 parser.add_argument('--iterations', type=int, default=1200, help='DemonsRegistrationFilterの反復回数')
 parser.add_argument('--stddev', type=float, default=4.0, help='DemonsRegistrationFilterの標準偏差')
 parser.add_argument('--workers', type=int, default=None, help='並列処理のワーカー数（デフォルトはCPUコア数）')
+parser.add_argument('--max_memory', type=float, default=None, help='位置合わせに使用するメモリの上限（GB、デフォルトは空きメモリの8割）')
 parser.add_argument('--fast', action='store_true', help='高速版DemonsRegistrationFilterを使用する')
 parser.add_argument('--multiscale', action='store_true', help='マルチスケール Demons を使用する(実験的実装)')
 parser.add_argument('--crf', type=int, default=23, help='ffmpegの画質設定（デフォルト: 23）')
@@ -47,28 +97,104 @@ parser.add_argument('--fps', type=int, default=7, help='動画のフレームレ
 parser.add_argument("--caption", action="store_true", help="各フレームの左下にファイル名を表示する")
 parser.add_argument("--caption_re", nargs=2, metavar=('PATTERN', 'REPLACEMENT'),
                     help="ファイル名の置換（正規表現）: PATTERN を REPLACEMENT に置換")
+parser.add_argument('--mask', action='append', default=[], help='動画に合成する輝度マスク画像（白: 表示, 黒: 非表示）。複数指定可')
+parser.add_argument('--overlay', action='append', default=[], help='動画に重ねる画像（アルファチャンネル付き PNG など）。複数指定可')
+parser.add_argument('--canvas', type=str, default=None, help='動画の出力サイズ 幅x高さ（例: 1920x1080）。フレームを縦横比を保って中央に配置する')
+parser.add_argument('--rendition', nargs='+', action='append', default=[], metavar=('OUTPUT', 'KEY=VALUE'),
+                    help='同時に生成する追加の動画（例: --rendition out_1080.mp4 height=1080 crf=25）。KEY は width, height, crf, fps, codec。複数指定可')
+parser.add_argument('--sort_by', choices=['time', 'name'], default='time', help='フレームの並び順（time: FITS ヘッダーの DATE-OBS 順, name: ファイル名順、デフォルト: time）')
+parser.add_argument('--time_start', type=parse_time_arg, default=None, help='対象とする観測日時の開始（例: 2025-07-29T05:00:00、DATE-OBS と同じ UTC で指定）')
+parser.add_argument('--time_end', type=parse_time_arg, default=None, help='対象とする観測日時の終了（例: 2025-07-29T07:00:00、DATE-OBS と同じ UTC で指定）')
+parser.add_argument('--auto_crop', action='store_true', help='全フレームの太陽面を含む範囲を検出し、位置合わせ前に切り抜く')
+parser.add_argument('--crop_margin', type=int, default=32, help='自動切り抜きで太陽面の外側に残す余白（画素、デフォルト: 32）')
+parser.add_argument('--crop', type=parse_crop_arg, default=None, help='位置合わせ前に切り抜く範囲 X0,Y0,X1,Y1（基準画像の座標、--rewarp で自動切り抜き時と同じ範囲を指定する場合など）')
+parser.add_argument('--quality_check', action='store_true', help='位置合わせ前にフレーム品質を評価し、低品質なフレームを除外する')
+parser.add_argument('--quality_scale', type=float, default=0.25, help='品質評価時の縮小率（デフォルト: 0.25）')
+parser.add_argument('--min_sharpness', type=float, default=0.5, help='鮮鋭度の下限（セッション中央値に対する比、デフォルト: 0.5）')
+parser.add_argument('--max_disk_residual', type=float, default=0.03, help='太陽面の円フィット残差の上限（半径に対する比、デフォルト: 0.03）')
+parser.add_argument('--field_dir', type=str, default=None, help='変位場の保存フォルダー（指定時は各フレームの変位場を保存する）')
+parser.add_argument('--field_scale', type=int, default=1, help='変位場を保存する際の縮小率 1/N（デフォルト: 1）')
+parser.add_argument('--field_dtype', choices=['float16', 'float32'], default='float16', help='変位場の保存形式（デフォルト: float16）')
+parser.add_argument('--field_order', type=int, choices=[1, 3], default=3, help='縮小保存した変位場を拡大する際のスプライン次数（デフォルト: 3）')
+parser.add_argument('--rewarp', action='store_true', help='位置合わせを行わず、--field_dir に保存済みの変位場を入力画像に適用する')
+parser.add_argument('--temporal_smooth', type=float, default=0, metavar='SIGMA',
+                    help='--rewarp の前に変位場を時間方向にガウス窓（標準偏差 SIGMA フレーム）で平滑化する（デフォルト: 0 = 平滑化しない）')
+parser.add_argument('--interpolator', choices=list(INTERPOLATORS), default='linear', help='位置合わせ後画像のリサンプリング補間方法（デフォルト: linear）')
+parser.add_argument('--write_plan', type=str, default=None, help='位置合わせを行わず、ジョブプラン（JSON）を作成して終了する')
+parser.add_argument('--plan', type=str, default=None, help='ジョブプラン（JSON）に従って処理する（パラメーターはプランの値を使用）')
+parser.add_argument('--shard', type=str, default=None, help='ジョブプランのうち担当する分割 i/N（i は 0 始まり）')
+parser.add_argument('--merge', action='store_true', help='ジョブプランの全フレームの処理完了を検証し、動画を生成する')
+parser.add_argument('--resume', action='store_true', help='同じ基準画像・パラメーターで処理済みのフレーム（メタデータが保存済み）をスキップする')
+parser.add_argument('--preview', type=parse_preview_arg, default=None, metavar='SCALE',
+                    help='縮小した画像で処理全体を試行するプレビューモード（例: 0.25）。--stddev は縮小率に合わせて自動で調整され、結果は aligned_dir/preview に保存する')
+parser.add_argument('--preview_frames', type=int, default=None, help='プレビューで処理するフレーム数（全体から等間隔に選択、デフォルト: 全フレーム）')
+parser.add_argument('--progress_events', action='store_true', help='進捗イベント（フレームの開始・終了、処理段階ごとの時間、変位量）を JSON Lines 形式で標準出力に出力する')
+parser.add_argument('--metrics_scale', type=float, default=0.5, help='位置合わせの品質指標（NCC, MSE, ヤコビアン行列式など）を計算する際の縮小率（デフォルト: 0.5）')
+parser.add_argument('--metrics_roi', type=parse_crop_arg, default=None, help='品質指標を計算する範囲 X0,Y0,X1,Y1（基準画像の座標、デフォルト: 画像全体）')
+parser.add_argument('--min_ncc', type=float, default=None, help='位置合わせ後の NCC の下限。下回ったフレームを警告し、レポートに記録する')
+parser.add_argument('--registration_report', type=str, default=None, help='フレームごとの変位量と品質指標の CSV ファイル（デフォルト: aligned_dir/registration_report.csv）')
+parser.add_argument('--quality_report', type=str, default=None, help='品質評価結果の CSV ファイル（デフォルト: aligned_dir/quality_report.csv）')
+
+# 基準画像のキャッシュ（ワーカープロセスごとに一度だけ読み込む）
+# バッチ処理では複数セッションの基準画像を扱うため、最近使用したものだけを保持する
+_reference_cache = collections.OrderedDict()
+REFERENCE_CACHE_SIZE = 4
+
+# 基準画像を読み込んでキャッシュする関数
+# crop が指定された場合は切り抜いた画像、scale が指定された場合はさらに縮小した画像を返す
+def get_reference_image(path, crop=None, scale=None):
+    key = (path, tuple(crop) if crop else None, scale)
+    if key in _reference_cache:
+        _reference_cache.move_to_end(key)
+    else:
+        image = load_reference_image(path)
+        if crop:
+            image = crop_sitk_image(image, crop)
+        if scale:
+            image = scale_sitk_image(image, scale)
+        _reference_cache[key] = image
+        while len(_reference_cache) > REFERENCE_CACHE_SIZE:
+            _reference_cache.popitem(last=False)
+    return _reference_cache[key]
+
+# SimpleITK画像を (x0, y0, x1, y1) の範囲で切り抜く関数
+# 切り抜き後も元画像と同じ物理座標を保つため、基準画像と入力画像を同じ範囲で切り抜けば位置が一致する
+def crop_sitk_image(image, crop):
+    x0, y0, x1, y1 = crop
+    return image[x0:x1, y0:y1]
+
+# SimpleITK画像を scale 倍に縮小する関数（プレビュー用、面積平均で縮小）
+def scale_sitk_image(image, scale):
+    if scale == 1:
+        return image
+    width, height = image.GetSize()
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    img = cv2.resize(sitk.GetArrayFromImage(image), size, interpolation=cv2.INTER_AREA)
+    return sitk.GetImageFromArray(img)
 
-args = parser.parse_args()
-
-# 各フォルダーの絶対パスを取得
-input_dir = os.path.abspath(args.input_dir)
-aligned_dir = os.path.abspath(args.aligned_dir)
-movie_dir = os.path.dirname(os.path.abspath(args.movie)) if args.movie else os.getcwd()
-os.makedirs(aligned_dir, exist_ok=True)
-os.makedirs(movie_dir, exist_ok=True)
-
-# 基準画像の拡張子を取得して、それに応じたファイルのみを対象にする
-ref_ext = os.path.splitext(args.ref)[1].lower()
-input_files = glob.glob(os.path.join(input_dir, f"*{ref_ext}"))
-input_files = sorted(input_files)
-
-# 基準画像の読み込みとサイズ取得
-ref_img_sitk = load_reference_image(args.ref)
-ref_img_np = sitk.GetArrayFromImage(ref_img_sitk)
-height, width = ref_img_np.shape
+# 品質指標を計算する範囲を、基準画像の座標から処理中の画像（切り抜き・縮小後）の座標に変換する関数
+def metrics_roi(args, width, height):
+    if not args.metrics_roi:
+        return None
+    x0, y0, x1, y1 = args.metrics_roi
+    if args.crop:
+        x0, y0, x1, y1 = x0 - args.crop[0], y0 - args.crop[1], x1 - args.crop[0], y1 - args.crop[1]
+    if args.preview:
+        x0, y0, x1, y1 = (round(v * args.preview) for v in (x0, y0, x1, y1))
+    x0, x1 = max(0, x0), min(width, x1)
+    y0, y1 = max(0, y0), min(height, y1)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"品質指標の計算範囲が画像の外にあります: {args.metrics_roi}")
+    return x0, y0, x1, y1
 
 # 各画像の位置合わせ処理を行う関数
-def process_image(f):
+def process_image(f, args):
+    full_size = get_reference_image(args.ref).GetSize()
+    ref_img_sitk = get_reference_image(args.ref, args.crop, args.preview)
+    width, height = ref_img_sitk.GetSize()
+    ref_ext = os.path.splitext(args.ref)[1].lower()
+    # Demons の標準偏差は画素単位のため、プレビューでは縮小率に合わせる（全解像度と同じ平滑化の範囲になる）
+    stddev = args.stddev * args.preview if args.preview else args.stddev
 
     # 通常の Demons 処理関数（マルチスケールなし）
     def single_resolution_demons(fixed, moving, iterations, stddev):
@@ -141,6 +267,16 @@ def process_image(f):
         return resized_image
 
     print(f"処理中: {os.path.basename(f)}", flush=True)
+    frame_start = time.perf_counter()
+    timings = {}
+    stage_start = frame_start
+
+    # 処理段階ごとの所要時間を記録する関数
+    def lap(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings[stage] = now - stage_start
+        stage_start = now
 
     # 入力画像の読み込みとリサンプリング
     ext = os.path.splitext(f)[1].lower()
@@ -155,8 +291,16 @@ def process_image(f):
         raise ValueError(f"対応していないファイル形式です: {ext}")
 
     # サイズが異なる場合はリサンプリング
-    if moving_image.GetSize() != ref_img_sitk.GetSize():
-        moving_image = resize_sitk_image(moving_image, ref_img_sitk.GetSize())
+    if moving_image.GetSize() != full_size:
+        moving_image = resize_sitk_image(moving_image, full_size)
+
+    # 基準画像と同じ範囲で切り抜き（以降の処理の画素数を削減）
+    if args.crop:
+        moving_image = crop_sitk_image(moving_image, args.crop)
+    # プレビューでは基準画像と同じ縮小率で縮小
+    if args.preview:
+        moving_image = scale_sitk_image(moving_image, args.preview)
+    lap('load')
 
     # ヒストグラムマッチング
     matcher = sitk.HistogramMatchingImageFilter()
@@ -164,16 +308,38 @@ def process_image(f):
     matcher.SetNumberOfMatchPoints(10)
     matcher.ThresholdAtMeanIntensityOn()
     moving_image = matcher.Execute(moving_image, ref_img_sitk)
-
-    # Demons Registration
-    if args.multiscale:
-        transform = multi_resolution_demons(ref_img_sitk, moving_image, args.iterations, args.stddev)
+    lap('histogram')
+
+    if args.rewarp:
+        # 保存済みの変位場を読み込む（Demons は実行しない）
+        # --temporal_smooth 指定時は時間方向に平滑化した変位場を使用する
+        field_dir = field_smoothing.smoothed_dir(args.field_dir) if args.temporal_smooth else args.field_dir
+        disp_np, field_ref = displacement_store.load_field(
+            displacement_store.field_path(field_dir, f), order=args.field_order)
+        if disp_np.shape[:2] != (height, width):
+            raise ValueError(f"変位場のサイズが基準画像（切り抜き後）と一致しません。--crop の指定を確認してください: {os.path.basename(f)}")
+        if field_ref != os.path.basename(args.ref):
+            print(f"警告: {os.path.basename(f)} の変位場は別の基準画像 ({field_ref}) で作成されています。", flush=True)
+        field_img = sitk.GetImageFromArray(disp_np, isVector=True)
+        field_img.CopyInformation(ref_img_sitk)
+        transform = sitk.DisplacementFieldTransform(field_img)
     else:
-        transform = single_resolution_demons(ref_img_sitk, moving_image, args.iterations, args.stddev)
-    displacement_field = transform.GetDisplacementField()
+        # Demons Registration
+        if args.multiscale:
+            transform = multi_resolution_demons(ref_img_sitk, moving_image, args.iterations, stddev)
+        else:
+            transform = single_resolution_demons(ref_img_sitk, moving_image, args.iterations, stddev)
+        displacement_field = transform.GetDisplacementField()
+        disp_np = sitk.GetArrayFromImage(displacement_field)
+
+        # 変位場を保存（再位置合わせなしで再レンダリングできるようにする）
+        if args.field_dir:
+            displacement_store.save_field(
+                displacement_store.field_path(args.field_dir, f), disp_np,
+                scale=args.field_scale, dtype=args.field_dtype, reference=os.path.basename(args.ref))
+    lap('registration')
 
     # 変位量の計算
-    disp_np = sitk.GetArrayFromImage(displacement_field)
     magnitude = np.linalg.norm(disp_np, axis=-1)
 
     mean_disp = np.mean(magnitude)
@@ -185,11 +351,22 @@ def process_image(f):
     # 位置合わせ後の画像を保存
     resampler = sitk.ResampleImageFilter()
     resampler.SetReferenceImage(ref_img_sitk)
-    resampler.SetInterpolator(sitk.sitkLinear)
+    resampler.SetInterpolator(INTERPOLATORS[args.interpolator])
     resampler.SetDefaultPixelValue(0)
     resampler.SetTransform(transform)
     aligned_sitk = resampler.Execute(moving_image)
     aligned_np = sitk.GetArrayFromImage(aligned_sitk)
+    lap('resample')
+
+    # 位置合わせの品質指標（基準画像との一致度と変位場の折り返し）
+    metrics = alignment_metrics.compute_alignment_metrics(
+        sitk.GetArrayFromImage(ref_img_sitk), aligned_np, sitk.GetArrayFromImage(moving_image), disp_np,
+        scale=args.metrics_scale, roi=metrics_roi(args, width, height))
+    lap('metrics')
+
+    print(f"品質指標: {os.path.basename(f)} - NCC: {metrics['ncc_before']:.4f} → {metrics['ncc']:.4f}, "
+          f"MSE: {metrics['mse_before']:.6f} → {metrics['mse']:.6f}, "
+          f"ヤコビアン: {metrics['jacobian_min']:.3f} - {metrics['jacobian_max']:.3f}, 折り返し: {metrics['folding']:.2%}", flush=True)
 
     # 画像の正規化と保存
     img_min = np.min(aligned_np)
@@ -203,21 +380,377 @@ def process_image(f):
         img_uint16 = cv2.resize(img_uint16, (width, height), interpolation=cv2.INTER_LINEAR)
 
     base_name = os.path.splitext(os.path.basename(f))[0]
-    save_path = os.path.join(aligned_dir, f"{base_name}{ref_ext}")
+    save_path = os.path.join(args.aligned_dir, f"{base_name}{ref_ext}")
 
+    # 中断時に書き込み途中のファイルが残らないよう、一時ファイルに保存してから置き換える
+    tmp_path = cancellation.partial_path(save_path)
     if ref_ext == '.png':
-        cv2.imwrite(save_path, img_uint16)
+        cv2.imwrite(tmp_path, img_uint16)
     elif ref_ext in ['.fits', '.fit']:
         fits_data = img_uint16.astype(np.float32)
         hdu = fits.PrimaryHDU(fits_data)
-        hdu.writeto(save_path, overwrite=True)
+        # 並べ替えに使用できるよう観測日時を引き継ぐ
+        if ext in ['.fits', '.fit']:
+            date_obs = fits.getheader(f).get('DATE-OBS')
+            if date_obs:
+                hdu.header['DATE-OBS'] = date_obs
+        hdu.writeto(tmp_path, overwrite=True)
     else:
         raise ValueError(f"保存形式に対応していません: {ref_ext}")
-
-    return img_uint16
+    os.replace(tmp_path, save_path)
+    lap('save')
+
+    # フレームごとのメタデータを保存（シャード処理の完了確認・中断後の再開にも使用）
+    # 画像の保存後に書き込むため、メタデータがあるフレームは出力も揃っている
+    meta = {
+        'frame': os.path.basename(f),
+        'source': os.path.abspath(f),
+        'output': os.path.basename(save_path),
+        'reference': os.path.basename(args.ref),
+        'reference_sha256': args.ref_sha256,
+        'plan_id': args.plan_id,
+        'params': {key: getattr(args, key) for key in job_plan.PLAN_PARAMS},
+        'displacement': {
+            'mean': float(mean_disp),
+            'max': float(max_disp),
+            'std': float(std_disp),
+        },
+        'metrics': metrics,
+        'timings': timings,
+        'elapsed': time.perf_counter() - frame_start,
+        'host': platform.node(),
+        'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+    job_plan.write_frame_meta(args.aligned_dir, f, meta)
+
+    return meta
+
+# 進捗イベントを出力しながら1フレームを処理する関数（ワーカープロセスで実行）
+def run_frame(f, args):
+    if not args.progress_events:
+        return process_image(f, args)
+    progress_events.emit('frame_started', frame=os.path.basename(f))
+    try:
+        meta = process_image(f, args)
+    except Exception as e:
+        progress_events.emit('frame_failed', frame=os.path.basename(f), error=str(e))
+        raise
+    progress_events.emit(
+        'frame_finished', frame=meta['frame'], output=meta['output'],
+        timings=meta['timings'], elapsed=meta['elapsed'], displacement=meta['displacement'],
+        metrics=meta['metrics'])
+    return meta
+
+# 進捗イベントを出力する関数（--progress_events 指定時のみ）
+def emit_progress(args, event, **fields):
+    if args.progress_events:
+        progress_events.emit(event, **fields)
+
+# プレビューモードの出力先などを設定する関数
+# 結果は aligned_dir/preview と動画名_preview に保存し、全解像度の結果は上書きしない
+def setup_preview(args):
+    args.aligned_dir = os.path.join(args.aligned_dir, 'preview')
+    if args.movie:
+        base, ext = os.path.splitext(args.movie)
+        args.movie = f"{base}_preview{ext}"
+    else:
+        args.movie = os.path.join(args.aligned_dir, 'preview.mp4')
+    if args.canvas:
+        width, height = (int(v) for v in args.canvas.lower().split('x'))
+        # 動画のエンコードのため偶数にする
+        args.canvas = f"{max(2, round(width * args.preview / 2) * 2)}x{max(2, round(height * args.preview / 2) * 2)}"
+    # 縮小した変位場は保存せず、追加の動画も生成しない
+    args.field_dir = None
+    args.rendition = []
+
+# プレビューで処理するフレームを全体から等間隔に選択する関数
+def select_preview_frames(input_files, count):
+    if not count or count >= len(input_files):
+        return input_files
+    indexes = sorted(set(np.linspace(0, len(input_files) - 1, count).round().astype(int)))
+    return [input_files[i] for i in indexes]
+
+# 出力先などのフォルダーを絶対パスにして作成する関数
+def prepare_dirs(args):
+    args.input_dir = os.path.abspath(args.input_dir)
+    args.aligned_dir = os.path.abspath(args.aligned_dir)
+    movie_dir = os.path.dirname(os.path.abspath(args.movie)) if args.movie else os.getcwd()
+    os.makedirs(args.aligned_dir, exist_ok=True)
+    os.makedirs(movie_dir, exist_ok=True)
+    # 前回中断された処理の書き込み途中のファイルを削除（シャードは同じフォルダーを共有するため除く）
+    if not args.shard:
+        cancellation.clean_partial(args.aligned_dir)
+    if args.field_dir:
+        args.field_dir = os.path.abspath(args.field_dir)
+        os.makedirs(args.field_dir, exist_ok=True)
+
+# 入力フォルダーの対象フレームの情報を返す関数（並べ替え・観測日時での絞り込みを含む）
+def list_input_frames(args):
+    # 基準画像の拡張子を取得して、それに応じたファイルのみを対象にする
+    # 基準画像を自動選択する場合は、入力フォルダーで最も多い形式を対象にする
+    if args.ref:
+        ref_ext = os.path.splitext(args.ref)[1].lower()
+    else:
+        ext_counts = {ext: len(glob.glob(os.path.join(args.input_dir, f"*{ext}"))) for ext in ['.fits', '.fit', '.png']}
+        ref_ext = max(ext_counts, key=ext_counts.get)
+    # ヘッダーのみを読み込んだインデックス（キャッシュ付き）で並べ替え・絞り込みを行う
+    frame_infos = fits_index.scan_directory(args.input_dir, exts=(ref_ext,))
+    frame_infos = fits_index.sort_frames(frame_infos, sort_by=args.sort_by)
+    if args.time_start or args.time_end:
+        frame_infos = fits_index.filter_time_window(frame_infos, args.time_start, args.time_end)
+        print(f"観測日時で絞り込みました: {len(frame_infos)} フレーム", flush=True)
+    return frame_infos
+
+# ワーカープールを作成するコンテキストマネージャー
+# ワーカー数は予算から決めた同時実行数とし、予算に含まれない待機中のワーカーを起動しない
+# 中断時は実行中のタスクも含めてワーカーを直ちに終了する
+@contextlib.contextmanager
+def worker_pool(max_workers):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=cancellation.init_worker) as executor:
+        try:
+            yield executor
+        except KeyboardInterrupt:
+            cancellation.terminate_workers(executor)
+            raise
+
+# 補助的な処理（品質評価・変位場の平滑化）をメモリ予算内で実行する関数（入力順に結果を返す）
+# frame_bytes: 1タスクあたりのメモリの見積もり
+def run_budgeted(args, fn, items, frame_bytes):
+    budget = memory_budget.memory_budget(args.max_memory)
+    max_inflight = memory_budget.max_concurrency(args.workers or os.cpu_count() or 1, frame_bytes, budget)
+    with worker_pool(max_inflight) as executor:
+        return memory_budget.run_scheduled(executor, fn, items, max_inflight, frame_bytes, budget)
+
+# 位置合わせ前の品質評価を行う関数（縮小画像で高速に評価し、低品質フレームを除外）
+# 基準画像の自動選択と自動切り抜きも同じ評価結果を用いる。位置合わせするフレームを返す
+# 評価では全解像度の画像を読み込むため、frame_infos の最大の画像サイズから同時実行数を制限する
+def assess_frames(args, input_files, frame_infos):
+    print("フレーム品質を評価しています...", flush=True)
+    emit_progress(args, 'stage', name='quality', frames=len(input_files))
+    input_set = set(input_files)
+    sizes = [(info['width'], info['height']) for info in frame_infos
+             if info['path'] in input_set and info['width'] and info['height']]
+    width, height = max(sizes, key=lambda size: size[0] * size[1], default=(0, 0))
+    frame_bytes = memory_budget.estimate_quality_bytes(width, height)
+    scores = run_budgeted(
+        args, functools.partial(frame_quality.compute_frame_quality, scale=args.quality_scale),
+        input_files, frame_bytes)
+    keep = (os.path.basename(args.ref),) if args.ref else ()
+    frame_quality.evaluate_quality(
+        scores,
+        min_sharpness=args.min_sharpness,
+        max_disk_residual=args.max_disk_residual,
+        keep=keep)
+
+    if args.auto_ref:
+        best = frame_quality.select_reference(scores, max_disk_residual=args.max_disk_residual)
+        if best is None:
+            raise ValueError("基準画像に適したフレームが見つかりません。")
+        args.ref = os.path.join(args.input_dir, best['file'])
+        print(f"基準画像を自動選択しました: {best['file']} (スコア: {best['ref_score']:.4f})", flush=True)
+
+    report_path = args.quality_report or os.path.join(args.aligned_dir, 'quality_report.csv')
+    frame_quality.write_report(report_path, scores)
+    print(f"品質評価結果を保存しました: {report_path}", flush=True)
+
+    if args.quality_check:
+        rejected = {s['file'] for s in scores if s['rejected']}
+        for s in scores:
+            if s['rejected']:
+                print(f"除外: {s['file']} - 理由: {s['reason']}, 相対鮮鋭度: {s['sharpness_rel']:.3f}", flush=True)
+        print(f"除外したフレーム数: {len(rejected)} / {len(scores)}", flush=True)
+        input_files = [f for f in input_files if os.path.basename(f) not in rejected]
+
+    if args.auto_crop:
+        # 除外されなかったフレームの太陽面をすべて含む範囲（縮小画像で検出済み）
+        full_width, full_height = get_reference_image(args.ref).GetSize()
+        input_names = {os.path.basename(f) for f in input_files}
+        crop = frame_quality.union_disk_box(
+            [s for s in scores if s['file'] in input_names],
+            full_width, full_height, margin=args.crop_margin)
+        if crop is None:
+            print("警告: 太陽面を検出できなかったため、切り抜きは行いません。", flush=True)
+        else:
+            args.crop = list(crop)
+            crop_width = crop[2] - crop[0]
+            crop_height = crop[3] - crop[1]
+            rate = crop_width * crop_height / (full_width * full_height)
+            print(f"切り抜き範囲: {','.join(str(v) for v in crop)} ({crop_width}x{crop_height}, 画素数 {rate:.1%})", flush=True)
+
+    return input_files
+
+# 基準画像の確認と処理済みフレームのスキップを行い、位置合わせするフレームを返す関数
+# frame_infos（ジョブプラン使用時は None）があれば、基準画像とサイズが異なるフレームを事前に通知する
+def check_frames(args, input_files, frame_infos=None, plan=None):
+    args.ref_sha256 = job_plan.file_sha256(args.ref)
+    if plan and args.ref_sha256 != plan['reference']['sha256']:
+        raise ValueError(f"基準画像がジョブプラン作成時から変更されています: {args.ref}")
+
+    # 同じ基準画像・パラメーターで処理済みのフレームをスキップ
+    if args.resume:
+        params = {key: getattr(args, key) for key in job_plan.PLAN_PARAMS}
+        remaining = [
+            f for f in input_files
+            if job_plan.frame_status(args.aligned_dir, f, args.ref_sha256, plan_id=args.plan_id, params=params)]
+        print(f"処理済みのフレームをスキップします: {len(input_files) - len(remaining)} / {len(input_files)}", flush=True)
+        input_files = remaining
+
+    # 基準画像とサイズが異なるフレームを事前に通知する（位置合わせ前にリサイズされる）
+    if frame_infos is not None:
+        ref_width, ref_height = get_reference_image(args.ref).GetSize()
+        input_names = {os.path.basename(f) for f in input_files}
+        mismatches = fits_index.find_size_mismatches(
+            [i for i in frame_infos if i['name'] in input_names], ref_width, ref_height)
+        for info in mismatches:
+            print(f"警告: {info['name']} のサイズ ({info['width']}x{info['height']}) が基準画像 ({ref_width}x{ref_height}) と異なります。リサイズして処理します。", flush=True)
+
+    return input_files
+
+# 再位置合わせの前に変位場を時間方向に平滑化する関数（--temporal_smooth 指定時）
+# sequence: 平滑化の窓の対象となる全フレーム（フレーム順、--resume でスキップするフレームも含む）
+# input_files: 再位置合わせするフレーム（これらのフレームの平滑化した変位場のみを作成する）
+# 連続するフレームのまとまりごとにワーカーへ割り当て、各ワーカーは窓の範囲の変位場だけを保持する
+# まとまりの数と同時実行数は、窓の範囲の変位場のメモリの見積もりとメモリ予算から決める
+def smooth_displacement_fields(args, sequence, input_files):
+    if not args.temporal_smooth or not input_files:
+        return
+    sequence = [f for f in sequence if os.path.exists(displacement_store.field_path(args.field_dir, f))]
+    positions = {f: i for i, f in enumerate(sequence)}
+    missing = [f for f in input_files if f not in positions]
+    if missing:
+        raise ValueError(f"変位場が保存されていないフレームがあります: {', '.join(os.path.basename(f) for f in missing[:5])}"
+                         f"{' など' if len(missing) > 5 else ''} ({len(missing)} フレーム)")
+
+    out_dir = field_smoothing.smoothed_dir(args.field_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    radius = field_smoothing.window_radius(args.temporal_smooth)
+    print(f"変位場を時間方向に平滑化しています: 標準偏差 {args.temporal_smooth} フレーム（窓 ±{radius} フレーム）, {len(input_files)} フレーム", flush=True)
+    emit_progress(args, 'stage', name='smoothing', frames=len(input_files))
+    smoothing_start = time.perf_counter()
+    field_paths = [displacement_store.field_path(args.field_dir, f) for f in sequence]
+    out_paths = [displacement_store.field_path(out_dir, f) for f in sequence]
+    run_bytes = field_smoothing.estimate_run_bytes(field_paths[positions[input_files[0]]], args.temporal_smooth)
+    budget = memory_budget.memory_budget(args.max_memory)
+    workers = memory_budget.max_concurrency(args.workers or os.cpu_count() or 1, run_bytes, budget)
+    runs = field_smoothing.split_runs([positions[f] for f in input_files], workers)
+    run_budgeted(
+        args, functools.partial(field_smoothing.smooth_fields, field_paths, out_paths, sigma=args.temporal_smooth),
+        runs, run_bytes)
+    print(f"変位場の平滑化が完了しました: {time.perf_counter() - smoothing_start:.1f} 秒, 保存先: {out_dir}", flush=True)
+
+# 画像サイズと処理方式から1フレームあたりのメモリを見積もる関数
+def estimate_memory(args):
+    work_width, work_height = get_reference_image(args.ref, args.crop, args.preview).GetSize()
+    return memory_budget.estimate_frame_bytes(work_width, work_height, multiscale=args.multiscale)
+
+# フレームごとの変位量と品質指標をレポート（CSV）に保存し、概要を表示する関数
+# 処理済みのメタデータから作成するため、--resume でスキップしたフレームも含まれる
+def write_registration_report(args, frames):
+    rows = []
+    for f in frames:
+        meta = job_plan.read_frame_meta(args.aligned_dir, f)
+        if meta is None or 'metrics' not in meta:
+            continue
+        row = job_plan.meta_report_row(meta)
+        if args.min_ncc is not None:
+            row['below_min_ncc'] = row['ncc'] < args.min_ncc
+        rows.append(row)
+    if not rows:
+        return rows
+
+    report_path = args.registration_report or os.path.join(args.aligned_dir, 'registration_report.csv')
+    frame_quality.write_report(report_path, rows)
+    print(f"位置合わせの結果を保存しました: {report_path}", flush=True)
+
+    nccs = np.array([row['ncc'] for row in rows])
+    worst = rows[int(np.argmin(nccs))]
+    folded = [row for row in rows if row['folding'] > 0]
+    print(f"NCC: 中央値 {np.median(nccs):.4f}, 最小 {worst['ncc']:.4f} ({worst['frame']}), 折り返しのあるフレーム: {len(folded)} / {len(rows)}", flush=True)
+    if args.min_ncc is not None:
+        below = [row for row in rows if row['below_min_ncc']]
+        for row in below:
+            print(f"警告: {row['frame']} の NCC ({row['ncc']:.4f}) が下限 ({args.min_ncc}) を下回っています。", flush=True)
+        print(f"NCC が下限を下回ったフレーム数: {len(below)} / {len(rows)}", flush=True)
+    return rows
+
+# generate_movie.py を呼び出して動画を生成する関数（生成した動画のパスを返す）
+def make_movie(args):
+    video_path = os.path.abspath(args.movie)
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    generate_script = os.path.join(script_dir, 'generate_movie.py')
+
+    generate_cmd = [
+        'python', generate_script,
+        args.aligned_dir,
+        video_path,
+        '--fps', str(args.fps),
+        '--crf', str(args.crf),
+        '--sort_by', args.sort_by
+    ]
+    # オプションの追加
+    if args.caption:
+        generate_cmd += ['--caption']
+    if args.caption_re:
+        generate_cmd += ['--caption_re'] + args.caption_re
+    for mask in args.mask:
+        generate_cmd += ['--mask', mask]
+    for overlay in args.overlay:
+        generate_cmd += ['--overlay', overlay]
+    if args.canvas:
+        generate_cmd += ['--canvas', args.canvas]
+    for rendition in args.rendition:
+        generate_cmd += ['--rendition'] + rendition
+
+    print("generate_movie.py による動画生成を開始します...", flush=True)
+    emit_progress(args, 'stage', name='movie', output=video_path)
+    cancellation.run_process(generate_cmd)
+    print(f'動画を保存しました: {video_path}', flush=True)
+    return video_path
 
 # メイン処理
 if __name__ == "__main__":
+    args = parser.parse_args()
+    # GUI などからの停止要求（SIGTERM）も Ctrl+C と同様に後始末してから終了する
+    cancellation.install_signal_handlers()
+    args.plan_id = None
+    plan = None
+    if args.plan:
+        if args.write_plan:
+            parser.error("--plan と --write_plan は同時に指定できません。")
+        plan = job_plan.load_plan(args.plan)
+        job_plan.apply_plan(plan, args)
+    elif args.shard or args.merge:
+        parser.error("--shard と --merge には --plan の指定が必要です。")
+    if not args.ref and not args.auto_ref:
+        parser.error("--ref または --auto_ref のいずれかを指定してください。")
+    if args.rewarp and not args.field_dir:
+        parser.error("--rewarp には --field_dir の指定が必要です。")
+    if args.rewarp and not args.ref:
+        parser.error("--rewarp には変位場を作成した際の --ref の指定が必要です。")
+    if args.temporal_smooth < 0:
+        parser.error("--temporal_smooth には 0 以上の値を指定してください。")
+    if args.temporal_smooth and not args.rewarp:
+        parser.error("--temporal_smooth には --rewarp の指定が必要です。")
+    if args.preview and (args.rewarp or args.write_plan or args.plan):
+        parser.error("--preview は --rewarp, --write_plan, --plan と同時に指定できません。")
+    if args.preview:
+        setup_preview(args)
+
+    # 各フォルダーの絶対パスを取得
+    prepare_dirs(args)
+
+    if plan:
+        # ジョブプランのフレームのうち、担当するシャードのみを対象にする
+        frame_infos = None
+        input_files = plan['frames']
+        if args.shard:
+            shard_index, shard_count = job_plan.parse_shard(args.shard)
+            input_files = job_plan.shard_frames(input_files, shard_index, shard_count)
+    else:
+        frame_infos = list_input_frames(args)
+        input_files = [info['path'] for info in frame_infos]
+
     start_time = datetime.datetime.now()
     print(f"実行開始: {start_time.strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
 
@@ -225,52 +758,72 @@ if __name__ == "__main__":
     for arg in vars(args):
         print(f"  {arg}: {getattr(args, arg)}", flush=True)
 
-    # 入力ファイルの存在確認
-    def get_next_movie_filename(movie_dir, base='timelapse', ext='.mp4'):
-        idx = 1
-        while True:
-            fname = f"{base}-{idx}{ext}"
-            fpath = os.path.join(movie_dir, fname)
-            if not os.path.exists(fpath):
-                return fpath
-            idx += 1
-
-    # 入力画像の存在確認
-    aligned_imgs = []
+    if args.merge:
+        # 全シャードの処理結果を検証（未完了のフレームがあれば動画は生成しない）
+        problems = job_plan.verify_plan(plan)
+        for frame, reason in problems:
+            print(f"未完了: {os.path.basename(frame)} - 理由: {reason}", flush=True)
+        if problems:
+            print(f"ジョブプランの処理が完了していません: {len(problems)} / {len(plan['frames'])}", flush=True)
+            exit(1)
+        print(f"ジョブプランの全フレームの処理完了を確認しました: {len(plan['frames'])} フレーム", flush=True)
+        input_files = []
+
+    results = []
     try:
-        with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
-            results = list(executor.map(process_image, input_files))
-            aligned_imgs.extend(results)
+        if not plan and (args.quality_check or args.auto_ref or args.auto_crop):
+            input_files = assess_frames(args, input_files, frame_infos)
+
+        if args.preview:
+            input_files = select_preview_frames(input_files, args.preview_frames)
+            print(f"プレビュー: 縮小率 {args.preview}, 標準偏差 {args.stddev * args.preview:.3f}（全解像度で {args.stddev}）, {len(input_files)} フレーム", flush=True)
+
+        if args.write_plan:
+            # ジョブプランを作成して終了（位置合わせは --plan --shard で実行）
+            new_plan = job_plan.write_plan(args.write_plan, args, input_files)
+            print(f"ジョブプランを保存しました: {args.write_plan} (ID: {new_plan['plan_id']}, {len(input_files)} フレーム)", flush=True)
+            exit(0)
+
+        # レポートには --resume でスキップするフレームも含める
+        report_files = plan['frames'] if args.merge else input_files
+        input_files = check_frames(args, input_files, frame_infos, plan)
+
+        # 1フレームあたりのメモリの見積もりから同時実行数（ワーカー数）を制限する
+        frame_bytes = estimate_memory(args)
+        budget = memory_budget.memory_budget(args.max_memory)
+        max_inflight = memory_budget.max_concurrency(args.workers or os.cpu_count() or 1, frame_bytes, budget)
+        budget_text = f"{budget / 1024 ** 3:.1f} GB" if budget is not None else "不明"
+        print(f"メモリ見積もり: 1フレームあたり {frame_bytes / 1024 ** 3:.2f} GB, 予算: {budget_text}, 同時実行数: {max_inflight}", flush=True)
+
+        # 時間方向の平滑化の窓はシャードの境界をまたぐため、ジョブプランの全フレームを対象にする
+        smooth_displacement_fields(args, plan['frames'] if plan else report_files, input_files)
+
+        emit_progress(args, 'run_started', total=len(input_files), max_inflight=max_inflight)
+        emit_progress(args, 'stage', name='registration', frames=len(input_files))
+        if input_files:
+            with worker_pool(max_inflight) as executor:
+                results = memory_budget.run_scheduled(
+                    executor, functools.partial(run_frame, args=args), input_files,
+                    max_inflight, frame_bytes, budget)
     except KeyboardInterrupt:
-        print("処理を中断しました。", flush=True)
+        print("処理を中断しました。完了したフレームは保存済みです。--resume を付けて再実行すると続きから処理します。", flush=True)
+        emit_progress(args, 'run_cancelled')
         exit(1)
 
-    if args.movie:
-        # 動画の出力ファイル名が指定されている場合
-        video_path = os.path.abspath(args.movie) if args.movie else get_next_movie_filename(movie_dir)
-
-        # generate_movie.py を呼び出して動画生成
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        generate_script = os.path.join(script_dir, 'generate_movie.py')
-
-        generate_cmd = [
-            'python', generate_script,
-            aligned_dir,
-            video_path,
-            '--fps', str(args.fps),
-            '--crf', str(args.crf)
-        ]
-        # オプションの追加
-        if args.caption:
-            generate_cmd += ['--caption']
-        if args.caption_re:
-            generate_cmd += ['--caption_re'] + args.caption_re
-
-        print("generate_movie.py による動画生成を開始します...", flush=True)
-        subprocess.run(generate_cmd, check=True)
-        print(f'動画を保存しました: {video_path}', flush=True)
+    # シャード処理の場合、レポートと動画はマージ時に作成する
+    if not args.shard:
+        write_registration_report(args, report_files)
+
+    if args.movie and not args.shard:
+        try:
+            make_movie(args)
+        except KeyboardInterrupt:
+            print("動画の生成を中断しました。", flush=True)
+            emit_progress(args, 'run_cancelled')
+            exit(1)
 
     end_time = datetime.datetime.now()
     print(f"実行終了: {end_time.strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
     elapsed_time = end_time - start_time
     print(f"実行時間: {str(elapsed_time)}", flush=True)
+    emit_progress(args, 'run_finished', frames=len(results), elapsed=elapsed_time.total_seconds())
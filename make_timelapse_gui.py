@@ -1,5 +1,6 @@
 import json
 import os
+import queue
 import subprocess
 import threading
 import signal
@@ -10,9 +11,21 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import tkinter.font as tkfont
 
+import progress_events
+
 CONFIG_FILE = "make_timelapse_gui_config.json"
 UI_FILE = "make_timelapse_gui_ui.json"
 
+# interval for draining subprocess output into the UI (milliseconds)
+OUTPUT_POLL_MS = 100
+# maximum number of lines handled per poll so the event loop stays responsive
+OUTPUT_MAX_LINES_PER_POLL = 2000
+# number of lines kept in the output widget during long runs
+OUTPUT_MAX_LINES = 5000
+# seconds Stop waits for the script to clean up (stop workers and ffmpeg,
+# remove partial files) before the process tree is killed
+STOP_TIMEOUT = 5
+
 def load_config():
     if os.path.exists(CONFIG_FILE):
         with open(CONFIG_FILE, "r", encoding="utf-8") as f:
@@ -38,6 +51,9 @@ class TimelapseGUI(tk.Tk):
         self.process = None
         # flag to stop output printing when Stop is requested
         self._stop_requested = False
+        # lines read from the subprocess; drained periodically on the Tk main thread
+        self.output_queue = queue.Queue()
+        self.progress = progress_events.ProgressTracker()
         self.config_data = load_config()
         self.widgets = {}
         self.build_ui()
@@ -218,6 +234,8 @@ class TimelapseGUI(tk.Tk):
                     btn.config(command=make_cmd2())
                 elif action == "run":
                     btn.config(command=self.run_script)
+                elif action == "preview":
+                    btn.config(command=self.run_preview)
                 elif action == "stop":
                     btn.config(command=self.stop_script)
                 elif action == "close":
@@ -280,6 +298,17 @@ class TimelapseGUI(tk.Tk):
                 self.widgets[name] = ("frame", frame)
         # previously the Run/Stop/Close were a fixed block; now they are defined via UI JSON
 
+        # Progress bar with throughput and ETA, fed by JSON progress events
+        # (shown as a status bar below the output text)
+        progress_frame = ttk.Frame(main_frame)
+        progress_def = ui_layout.get('progress') or {}
+        progress_opts = grid_options(progress_def, defaults={'row': 102, 'column': 0, 'columnspan': 3, 'sticky': 'ew', 'pady': 5})
+        progress_frame.grid(**progress_opts)
+        self.progress_bar = ttk.Progressbar(progress_frame, orient="horizontal", mode="determinate", maximum=1.0)
+        self.progress_bar.pack(side="left", fill="x", expand=True)
+        self.progress_label = ttk.Label(progress_frame, text="", width=progress_def.get('label_width', 48))
+        self.progress_label.pack(side="left", padx=(8, 0))
+
         # Output Text with vertical scrollbar
         text_frame = ttk.Frame(main_frame)
         # allow overriding the output text grid via a top-level key in UI JSON
@@ -375,6 +404,87 @@ class TimelapseGUI(tk.Tk):
         except Exception:
             pass
 
+    def trim_output(self):
+        """Drop the oldest lines so the widget stays fast on long runs."""
+        try:
+            lines = int(self.output_text.index("end-1c").split(".")[0])
+            if lines > OUTPUT_MAX_LINES:
+                self.output_text.config(state='normal')
+                self.output_text.delete("1.0", f"{lines - OUTPUT_MAX_LINES + 1}.0")
+                self.output_text.config(state='disabled')
+        except Exception:
+            pass
+
+    def update_progress(self):
+        tracker = self.progress
+        try:
+            self.progress_bar.config(value=tracker.fraction())
+        except Exception:
+            pass
+        if not tracker.total:
+            text = f"Stage: {tracker.stage}" if tracker.stage else ""
+        else:
+            rate = tracker.throughput()
+            rate_text = f"{rate * 60:.1f} frames/min" if rate else "-- frames/min"
+            text = (f"{tracker.done}/{tracker.total} frames"
+                    f"{f' ({tracker.failed} failed)' if tracker.failed else ''}"
+                    f"  {rate_text}  ETA {progress_events.format_duration(tracker.eta())}")
+            if tracker.stage == 'movie':
+                text += "  (generating movie)"
+            elif tracker.stage == 'finished':
+                text = f"{tracker.done}/{tracker.total} frames  finished"
+            elif tracker.stage == 'cancelled':
+                text = f"{tracker.done}/{tracker.total} frames  cancelled"
+        try:
+            self.progress_label.config(text=text)
+        except Exception:
+            pass
+
+    def poll_output(self, output_queue):
+        """Drain queued subprocess output on the Tk main thread.
+
+        Plain lines are appended to the output widget in one batch per poll and
+        JSON progress events update the progress bar instead of the log.
+        """
+        texts = []
+        finished = False
+        for _ in range(OUTPUT_MAX_LINES_PER_POLL):
+            try:
+                line = output_queue.get_nowait()
+            except queue.Empty:
+                break
+            if line is None:
+                finished = True
+                break
+            record = progress_events.parse_event(line)
+            if record is not None:
+                self.progress.update(record)
+            elif not self._stop_requested:
+                texts.append(line)
+        if texts:
+            self.append_output("".join(texts))
+            self.trim_output()
+        self.update_progress()
+        if not finished:
+            self.after(OUTPUT_POLL_MS, self.poll_output, output_queue)
+        elif output_queue is self.output_queue:
+            # ignore the end of a previous run that was stopped and replaced
+            self.finalize_run()
+
+    def finalize_run(self):
+        # mark process as finished and re-enable buttons
+        self.process = None
+        self.enable_run_buttons()
+
+    def enable_run_buttons(self):
+        for button_name in ("close", "run", "preview"):
+            button_pair = self.widgets.get(button_name)
+            if button_pair:
+                try:
+                    button_pair[1].config(state="normal")
+                except Exception:
+                    pass
+
     def load_previous_values(self):
         for key, pair in self.widgets.items():
             wtype, widget = pair
@@ -415,17 +525,28 @@ class TimelapseGUI(tk.Tk):
                     inputs[key] = False
         return inputs
 
-    def run_script(self):
+    def run_preview(self):
+        self.run_script(preview=True)
+
+    def run_script(self, preview=False):
         inputs = self.collect_inputs()
         save_config(inputs)
 
-        cmd = [sys.executable, "make_timelapse.py"]
+        cmd = [sys.executable, "make_timelapse.py", "--progress_events"]
+        if preview:
+            # low-resolution proxy run; results go to aligned_dir/preview and <movie>_preview
+            cmd.extend(["--preview", inputs.get("preview_scale") or "0.25"])
+            if inputs.get("preview_frames"):
+                cmd.extend(["--preview_frames", inputs.get("preview_frames")])
 
         def add_arg(flag, value):
             if value:
                 cmd.extend([flag, value])
 
-        add_arg("--ref", inputs.get("ref"))
+        if inputs.get("auto_ref") == True:
+            cmd.append("--auto_ref")
+        else:
+            add_arg("--ref", inputs.get("ref"))
         add_arg("--input_dir", inputs.get("input_dir"))
         add_arg("--aligned_dir", inputs.get("aligned_dir"))
         if inputs.get("movie"):
@@ -438,6 +559,8 @@ class TimelapseGUI(tk.Tk):
             cmd.append("--fast")
         if inputs.get("multiscale") == True:
             cmd.append("--multiscale")
+        if inputs.get("resume") == True:
+            cmd.append("--resume")
         add_arg("--crf", inputs.get("crf"))
         fps = inputs.get("fps")
         if fps:
@@ -462,75 +585,87 @@ class TimelapseGUI(tk.Tk):
                 close_pair[1].config(state="disabled")
             except Exception:
                 pass
-        # disable run button to prevent re-entry
-        run_pair = self.widgets.get("run")
-        if run_pair:
-            try:
-                run_pair[1].config(state="disabled")
-            except Exception:
-                pass
-        # clear stop flag for new run
+        # disable run/preview buttons to prevent re-entry
+        for button_name in ("run", "preview"):
+            button_pair = self.widgets.get(button_name)
+            if button_pair:
+                try:
+                    button_pair[1].config(state="disabled")
+                except Exception:
+                    pass
+        # clear stop flag and progress for new run
         self._stop_requested = False
-        # On Windows, create new process group to make termination more reliable
+        self.progress.reset()
+        self.update_progress()
+        self.output_queue = queue.Queue()
+        # Start the script in its own process group so Stop can terminate the
+        # whole tree (pool workers and ffmpeg) instead of only the top-level process
         popen_kwargs = dict(stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
         if os.name == 'nt':
             popen_kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            popen_kwargs['start_new_session'] = True
         self.process = subprocess.Popen(cmd, **popen_kwargs)
 
+        output_queue = self.output_queue
+        process = self.process
+
         def read_output():
-            for line in self.process.stdout:
-                # if stop was requested, stop printing further lines
-                if getattr(self, '_stop_requested', False):
-                    break
-                # schedule append on main thread
-                try:
-                    self.output_text.after(0, lambda l=line: self.append_output(l))
-                except Exception:
-                    # fallback: try direct append
-                    try:
-                        self.append_output(line)
-                    except Exception:
-                        pass
+            # only enqueue here; the Tk main thread drains the queue in batches
+            for line in process.stdout:
+                output_queue.put(line)
+            output_queue.put(None)
 
-            def _finalize_after_read():
-                # mark process as finished and re-enable buttons
-                self.process = None
-                close_pair = self.widgets.get("close")
-                run_pair = self.widgets.get("run")
-                if close_pair:
-                    try:
-                        close_pair[1].config(state="normal")
-                    except Exception:
-                        pass
-                if run_pair:
-                    try:
-                        run_pair[1].config(state="normal")
-                    except Exception:
-                        pass
+        threading.Thread(target=read_output, daemon=True).start()
+        self.after(OUTPUT_POLL_MS, self.poll_output, output_queue)
 
-            try:
-                # schedule finalization on main thread
-                self.output_text.after(0, _finalize_after_read)
-            except Exception:
-                _finalize_after_read()
+    def kill_process_tree(self, process):
+        """Terminate the process together with its workers and ffmpeg children.
 
-        threading.Thread(target=read_output, daemon=True).start()
+        The script is asked to stop first so it can clean up: on POSIX its
+        session's process group is sent SIGTERM, on Windows its process group
+        is sent CTRL_BREAK_EVENT (both are handled like Ctrl+C by
+        cancellation.install_signal_handlers). If it is still alive after
+        STOP_TIMEOUT the tree is killed (SIGKILL / taskkill /T /F).
+        """
+        if os.name == 'nt':
+            try:
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+                process.wait(timeout=STOP_TIMEOUT)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+            except OSError:
+                # the process has already exited or cannot receive console events
+                pass
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(process.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            process.wait(timeout=2)
+            return
+        try:
+            pgid = os.getpgid(process.pid)
+        except ProcessLookupError:
+            return
+        try:
+            os.killpg(pgid, signal.SIGTERM)
+            process.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            pass
+        except ProcessLookupError:
+            return
+        # workers may outlive the parent briefly; make sure nothing in the group survives
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait(timeout=2)
 
     def stop_script(self):
         # indicate we want to stop printing further output
         self._stop_requested = True
         if self.process:
             try:
-                self.process.terminate()
-                try:
-                    self.process.wait(timeout=2)
-                except Exception:
-                    # still alive -> force kill
-                    try:
-                        self.process.kill()
-                        self.process.wait(timeout=2)
-                    except Exception:
-                        pass
+                self.kill_process_tree(self.process)
             except Exception:
                 try:
                     self.process.kill()
@@ -541,23 +676,13 @@ class TimelapseGUI(tk.Tk):
                 try:
                     # use append_output to keep widget disabled for user
                     try:
-                        self.output_text.after(0, lambda: self.append_output("\nProcess terminated.\n"))
+                        self.output_text.after(0, lambda: self.append_output(
+                            "\nProcess terminated. Completed frames are kept; check Resume to continue.\n"))
                     except Exception:
                         self.append_output("\nProcess terminated.\n")
                 except Exception:
                     pass
-                close_pair = self.widgets.get("close")
-                if close_pair:
-                    try:
-                        close_pair[1].config(state="normal")
-                    except Exception:
-                        pass
-                run_pair = self.widgets.get("run")
-                if run_pair:
-                    try:
-                        run_pair[1].config(state="normal")
-                    except Exception:
-                        pass
+                self.enable_run_buttons()
 
     def on_close(self):
         inputs = self.collect_inputs()
@@ -0,0 +1,147 @@
+import os
+import sys
+import concurrent.futures
+
+# 1画素あたりの作業メモリの概算（バイト）
+# 入力画像・ヒストグラムマッチ後の画像・位置合わせ後の画像（float32）、
+# Demons の変位場と更新量（2チャンネル float64）、NumPy への変換時のコピーなどの合計
+BYTES_PER_PIXEL = 96
+# マルチスケール Demons で追加される変位場（初期値・縮小版・更新後、float64）
+BYTES_PER_PIXEL_MULTISCALE = 48
+# 品質評価で1画素あたりに必要なメモリの概算（バイト）
+# 全解像度の画像の読み込み（float64 の FITS を含む）と、縮小前の float32 への変換・正規化のコピーの合計
+QUALITY_BYTES_PER_PIXEL = 24
+# ワーカープロセス自体（Python, NumPy, SimpleITK など）の使用量の概算
+WORKER_OVERHEAD = 200 * 1024 ** 2
+# 予算の指定がない場合に使用する空きメモリの割合
+DEFAULT_BUDGET_RATE = 0.8
+
+# 1フレームの処理に必要なメモリを見積もる関数
+def estimate_frame_bytes(width, height, multiscale=False):
+    per_pixel = BYTES_PER_PIXEL
+    if multiscale:
+        per_pixel += BYTES_PER_PIXEL_MULTISCALE
+    return width * height * per_pixel + WORKER_OVERHEAD
+
+# 品質評価（縮小前の全解像度画像の読み込み）で1フレームに必要なメモリを見積もる関数
+def estimate_quality_bytes(width, height):
+    return width * height * QUALITY_BYTES_PER_PIXEL + WORKER_OVERHEAD
+
+# システムの空きメモリ（バイト）を返す関数（取得できない場合は None）
+def available_memory():
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/meminfo', 'r') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+    elif os.name == 'nt':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ('dwLength', ctypes.c_ulong),
+                ('dwMemoryLoad', ctypes.c_ulong),
+                ('ullTotalPhys', ctypes.c_ulonglong),
+                ('ullAvailPhys', ctypes.c_ulonglong),
+                ('ullTotalPageFile', ctypes.c_ulonglong),
+                ('ullAvailPageFile', ctypes.c_ulonglong),
+                ('ullTotalVirtual', ctypes.c_ulonglong),
+                ('ullAvailVirtual', ctypes.c_ulonglong),
+                ('sullAvailExtendedVirtual', ctypes.c_ulonglong),
+            ]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+    else:
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            return None
+    return None
+
+# プロセスの常駐メモリ（RSS, バイト）を返す関数（Linux のみ、取得できない場合は None）
+def process_rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+# ワーカープロセスの RSS の増加量の合計を返す関数（取得できない場合は None）
+# 待機中のワーカーの RSS は親プロセスと共有するページ（Python, NumPy など）が大半のため予算に含めず、
+# ワーカーごとに観測した RSS の最小値（baseline に記録し、呼び出しごとに更新する）からの増加量を合計する
+def workers_rss(executor, baseline):
+    processes = getattr(executor, '_processes', None) or {}
+    total = 0
+    for pid in list(processes):
+        rss = process_rss(pid)
+        if rss is None:
+            return None
+        baseline[pid] = min(rss, baseline.get(pid, rss))
+        total += rss - baseline[pid]
+    return total
+
+# メモリ予算（バイト）を決める関数
+# max_memory_gb の指定がなければ現在の空きメモリの一定割合を予算とする
+def memory_budget(max_memory_gb=None):
+    if max_memory_gb:
+        return int(max_memory_gb * 1024 ** 3)
+    available = available_memory()
+    if available is None:
+        return None
+    return int(available * DEFAULT_BUDGET_RATE)
+
+# 予算内で同時に処理できるフレーム数を返す関数
+def max_concurrency(workers, frame_bytes, budget):
+    if budget is None:
+        return workers
+    return max(1, min(workers, budget // frame_bytes))
+
+# メモリ予算を守りながらタスクを投入し、入力順に結果を返す関数
+# 同時実行数を max_inflight 以下に抑えたうえで、ワーカーの RSS の増加量が予算に近づいた場合や
+# システムの空きメモリが不足した場合は、実行中のタスクが終わるまで投入を待つ
+# on_done を指定した場合は、タスクが完了するたびに (入力の番号, 結果) を渡して呼び出す
+def run_scheduled(executor, fn, items, max_inflight, frame_bytes, budget=None, poll_interval=1.0, on_done=None):
+    futures = [None] * len(items)
+    indexes = {}
+    pending = set()
+    next_index = 0
+    baseline = {}
+
+    def can_submit():
+        if not pending:
+            return True
+        if len(pending) >= max_inflight:
+            return False
+        available = available_memory()
+        if available is not None and available < frame_bytes:
+            return False
+        if budget is not None:
+            rss = workers_rss(executor, baseline)
+            if rss is not None and rss + frame_bytes > budget:
+                return False
+        return True
+
+    while next_index < len(items) or pending:
+        while next_index < len(items) and can_submit():
+            future = executor.submit(fn, items[next_index])
+            futures[next_index] = future
+            indexes[future] = next_index
+            pending.add(future)
+            next_index += 1
+        if pending:
+            done, _ = concurrent.futures.wait(
+                pending, timeout=poll_interval, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                # 例外は早めに検出して以降の投入を止める
+                result = future.result()
+                if on_done is not None:
+                    on_done(indexes[future], result)
+
+    return [future.result() for future in futures]
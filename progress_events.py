@@ -0,0 +1,98 @@
+import json
+import time
+import collections
+
+# 進捗イベントの識別キー（標準出力の1行が1つの JSON オブジェクト）
+EVENT_KEY = 'event'
+
+# スループットの計算に使用する直近の完了フレーム数
+THROUGHPUT_WINDOW = 20
+
+# 進捗イベントを標準出力に1行の JSON として出力する関数
+# ワーカープロセスからも呼ばれるため、1回の print で行全体を書き込む
+def emit(event, **fields):
+    record = {EVENT_KEY: event, 'time': time.time()}
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, separators=(',', ':')), flush=True)
+
+# 出力の1行を進捗イベントとして解釈する関数（イベントでない行は None）
+def parse_event(line):
+    line = line.strip()
+    if not line.startswith('{'):
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or EVENT_KEY not in record:
+        return None
+    return record
+
+# 進捗イベントから処理済みフレーム数・スループット・残り時間を集計するクラス
+class ProgressTracker:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.running = set()
+        self.stage = None
+        self.start_time = None
+        self.last_frame = None
+        self.finished_times = collections.deque(maxlen=THROUGHPUT_WINDOW)
+
+    # イベントを1件反映する
+    def update(self, record):
+        event = record.get(EVENT_KEY)
+        now = record.get('time', time.time())
+        if event == 'run_started':
+            self.reset()
+            self.total = record.get('total', 0)
+            self.start_time = now
+        elif event == 'stage':
+            self.stage = record.get('name')
+        elif event == 'frame_started':
+            self.running.add(record.get('frame'))
+        elif event == 'frame_finished':
+            self.running.discard(record.get('frame'))
+            self.done += 1
+            self.last_frame = record
+            self.finished_times.append(now)
+        elif event == 'frame_failed':
+            self.running.discard(record.get('frame'))
+            self.failed += 1
+        elif event == 'run_finished':
+            self.stage = 'finished'
+        elif event == 'run_cancelled':
+            self.stage = 'cancelled'
+
+    # 直近のフレームの完了間隔から求めたスループット（フレーム/秒、不明な場合は None）
+    def throughput(self):
+        times = self.finished_times
+        if len(times) >= 2 and times[-1] > times[0]:
+            return (len(times) - 1) / (times[-1] - times[0])
+        if len(times) == 1 and self.start_time is not None and times[0] > self.start_time:
+            return 1 / (times[0] - self.start_time)
+        return None
+
+    # 残り時間（秒、不明な場合は None）
+    def eta(self):
+        rate = self.throughput()
+        if not rate or not self.total:
+            return None
+        return max(0, self.total - self.done - self.failed) / rate
+
+    # 進捗の割合（0-1）
+    def fraction(self):
+        if not self.total:
+            return 0.0
+        return min(1.0, (self.done + self.failed) / self.total)
+
+# 秒数を H:MM:SS 形式の文字列にする関数
+def format_duration(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
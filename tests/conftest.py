@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import shutil
+import datetime
+import subprocess
+import numpy as np
+import pytest
+from astropy.io import fits
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(REPO_DIR, 'samples', '10_simple', 'input')
+
+# テスト対象のモジュールをリポジトリのルートから import できるようにする
+sys.path.insert(0, REPO_DIR)
+
+import progress_events
+
+
+def pytest_addoption(parser):
+    parser.addoption('--update-golden', action='store_true',
+                     help='位置合わせ結果のゴールデンデータ（tests/golden）を現在の出力で更新する')
+    parser.addoption('--timing-scale', type=float, default=1.0,
+                     help='処理段階ごとの時間の上限に掛ける倍率（遅いマシンで実行する場合に指定）')
+
+
+@pytest.fixture(scope='session')
+def update_golden(request):
+    return request.config.getoption('--update-golden')
+
+
+@pytest.fixture(scope='session')
+def timing_scale(request):
+    return request.config.getoption('--timing-scale')
+
+
+# リポジトリのスクリプトを別プロセスで実行する関数（失敗した場合は出力を表示してテストを失敗させる）
+def run_script(script, *args, cwd=None, check=True):
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, script)] + [str(a) for a in args],
+        cwd=cwd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    if check and result.returncode != 0:
+        pytest.fail(f"{script} が終了コード {result.returncode} で終了しました\n{result.stdout}\n{result.stderr}")
+    return result
+
+
+# 出力から進捗イベントを取り出す関数
+def parse_events(stdout):
+    return [e for e in (progress_events.parse_event(line) for line in stdout.splitlines()) if e]
+
+
+# 太陽面を模した合成画像の系列を作成する関数
+# 太陽面の位置が少しずつずれ、表面の模様がフレームごとに変形する。DATE-OBS はファイル名の逆順に設定する
+def make_synthetic_sequence(directory, count=6, width=160, height=120, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    spots = rng.uniform([-0.6, -0.6, 2.0], [0.6, 0.6, 5.0], size=(12, 3))
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float64)
+    radius = min(width, height) * 0.4
+    start = datetime.datetime(2025, 7, 29, 5, 0, 0)
+    paths = []
+    for i in range(count):
+        cx = width / 2 + 1.5 * np.sin(i * 0.9)
+        cy = height / 2 + 1.0 * np.cos(i * 0.7)
+        r2 = ((xx - cx) ** 2 + (yy - cy) ** 2) / radius ** 2
+        img = np.where(r2 < 1, 0.6 + 0.4 * np.sqrt(np.clip(1 - r2, 0, 1)), 0.02)
+        # 表面の模様（黒点）はフレームごとにわずかに揺らぐ
+        for sx, sy, size in spots:
+            px = cx + sx * radius + 0.8 * np.sin(i * 1.3 + sx * 5)
+            py = cy + sy * radius + 0.8 * np.cos(i * 1.1 + sy * 5)
+            img -= 0.3 * np.exp(-((xx - px) ** 2 + (yy - py) ** 2) / (2 * size ** 2)) * (r2 < 1)
+        img += rng.normal(0, 0.005, img.shape)
+        hdu = fits.PrimaryHDU((img * 1000).astype(np.float32))
+        hdu.header['DATE-OBS'] = (start + datetime.timedelta(minutes=i)).isoformat()
+        path = os.path.join(directory, f"syn{count - i:02d}.fits")
+        hdu.writeto(path)
+        paths.append(path)
+    return paths
+
+
+# samples/10_simple の入力画像（作業用フォルダーにコピーし、サンプルのフォルダーにはインデックスを作成しない）
+@pytest.fixture(scope='session')
+def simple_input(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('simple') / 'input'
+    shutil.copytree(SAMPLE_DIR, directory, ignore=shutil.ignore_patterns('.*'))
+    return str(directory)
+
+
+# 合成画像の系列（時刻順のパスのリスト）
+@pytest.fixture(scope='session')
+def synthetic_frames(tmp_path_factory):
+    return make_synthetic_sequence(str(tmp_path_factory.mktemp('synthetic') / 'input'))
+
+
+# ffmpeg と ffprobe が必要なテスト
+@pytest.fixture(scope='session')
+def ffmpeg():
+    if not (shutil.which('ffmpeg') and shutil.which('ffprobe')):
+        pytest.skip('ffmpeg / ffprobe が見つかりません')
+
+
+# ffprobe で動画のフレーム数とサイズを取得する関数
+def probe_video(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_frames',
+         '-show_entries', 'stream=width,height,nb_read_frames', '-of', 'json', path],
+        capture_output=True, text=True, check=True)
+    stream = json.loads(result.stdout)['streams'][0]
+    return int(stream['nb_read_frames']), int(stream['width']), int(stream['height'])
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import alignment_metrics
+
+
+def pattern(height=64, width=80):
+    yy, xx = np.mgrid[0:height, 0:width]
+    return (np.sin(xx / 5.0) + np.cos(yy / 7.0)).astype(np.float32)
+
+
+def test_ncc_and_mse():
+    a = pattern()
+    assert alignment_metrics.ncc(a, a) == pytest.approx(1)
+    assert alignment_metrics.ncc(a, -a) == pytest.approx(-1)
+    assert alignment_metrics.ncc(a, 2 * a + 3) == pytest.approx(1)
+    assert alignment_metrics.ncc(np.zeros_like(a), a) == 0
+    assert alignment_metrics.mse(a, a + 0.5) == pytest.approx(0.25)
+
+
+def test_residual_energy():
+    a = pattern()
+    assert alignment_metrics.residual_energy(a, a) == 0
+    assert alignment_metrics.residual_energy(a, a.mean() * np.ones_like(a)) == pytest.approx(1, rel=1e-4)
+
+
+def test_jacobian_determinant():
+    field = np.zeros((20, 30, 2))
+    np.testing.assert_allclose(alignment_metrics.jacobian_determinant(field), 1)
+    # x 方向に 10% 伸ばす変形
+    xx = np.mgrid[0:20, 0:30][1]
+    field[..., 0] = 0.1 * xx
+    np.testing.assert_allclose(alignment_metrics.jacobian_determinant(field), 1.1)
+    # 縮小した変位場では画素間隔で勾配を補正する
+    np.testing.assert_allclose(alignment_metrics.jacobian_determinant(field, spacing=2.0), 1.05)
+    # x 方向に折り返す変形
+    field[..., 0] = -2 * xx
+    assert np.all(alignment_metrics.jacobian_determinant(field) < 0)
+
+
+def test_compute_alignment_metrics():
+    reference = pattern()
+    moving = np.roll(reference, 2, axis=1)
+    field = np.zeros(reference.shape + (2,))
+    metrics = alignment_metrics.compute_alignment_metrics(reference, reference, moving, field, scale=0.5)
+    assert metrics['ncc'] == pytest.approx(1)
+    assert metrics['ncc_before'] < metrics['ncc']
+    assert metrics['mse'] == 0 and metrics['mse_before'] > 0
+    assert metrics['jacobian_min'] == pytest.approx(1) and metrics['folding'] == 0
+
+
+def test_compute_alignment_metrics_roi():
+    reference = pattern()
+    aligned = reference.copy()
+    aligned[:, 40:] = 0
+    full = alignment_metrics.compute_alignment_metrics(reference, aligned, aligned, np.zeros(reference.shape + (2,)))
+    roi = alignment_metrics.compute_alignment_metrics(
+        reference, aligned, aligned, np.zeros(reference.shape + (2,)), roi=(0, 0, 40, 64))
+    assert roi['mse'] == 0 and full['mse'] > 0
@@ -0,0 +1,30 @@
+import pytest
+import batch_timelapse
+
+
+def test_job_argv():
+    argv = batch_timelapse.job_argv({
+        'name': 'session', 'ref': 'a.fits', 'iterations': 200, 'fast': True, 'multiscale': False,
+        'mask': ['m1.png', 'm2.png'], 'rendition': [['small.mp4', 'height=720']], 'crop': '0,0,100,100',
+        'caption_re_pattern': '(.*)', 'caption_re_replacement': r'\1',
+    })
+    assert argv == ['--ref', 'a.fits', '--iterations', '200', '--fast', '--mask', 'm1.png', '--mask', 'm2.png',
+                    '--rendition', 'small.mp4', 'height=720', '--crop', '0,0,100,100',
+                    '--caption_re', '(.*)', r'\1']
+
+
+@pytest.mark.parametrize('job', [{'workers': 2}, {'unknown_option': 1}])
+def test_job_argv_rejects_options(job):
+    with pytest.raises(ValueError):
+        batch_timelapse.job_argv(job)
+
+
+def test_job_args():
+    args = batch_timelapse.job_args({'ref': 'a.fits', 'input_dir': 'input', 'aligned_dir': 'aligned',
+                                     'preview': 0.5, 'movie': 'out.mp4'}, progress=True)
+    assert args.progress_events and args.plan_id is None
+    assert args.movie == 'out_preview.mp4'
+    for job in ({'input_dir': 'input'}, {'ref': 'a.fits', 'rewarp': True},
+                {'ref': 'a.fits', 'field_dir': 'fields', 'temporal_smooth': 1.0}):
+        with pytest.raises(ValueError):
+            batch_timelapse.job_args(job)
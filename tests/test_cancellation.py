@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+import concurrent.futures
+import pytest
+import cancellation
+
+
+def test_partial_path_and_clean(tmp_path):
+    path = cancellation.partial_path(str(tmp_path / 'Image01.fits'))
+    assert os.path.dirname(path) == str(tmp_path / cancellation.PARTIAL_DIR)
+    assert os.path.basename(path) == f'Image01.{os.getpid()}.fits'
+    open(path, 'w').close()
+    cancellation.clean_partial(str(tmp_path))
+    assert not os.path.exists(tmp_path / cancellation.PARTIAL_DIR)
+
+
+def test_run_process_success(tmp_path):
+    output = tmp_path / 'out.txt'
+    cancellation.run_process([sys.executable, '-c', f'open({str(output)!r}, "w").write("ok")'], outputs=[str(output)])
+    assert output.read_text() == 'ok'
+    assert not cancellation._children
+
+
+def test_run_process_failure_removes_outputs(tmp_path):
+    output = tmp_path / 'out.txt'
+    script = f'open({str(output)!r}, "w").write("partial"); raise SystemExit(3)'
+    with pytest.raises(subprocess.CalledProcessError):
+        cancellation.run_process([sys.executable, '-c', script], outputs=[str(output)])
+    assert not output.exists()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='SIGTERM は POSIX のみ')
+def test_signal_handler_raises_keyboard_interrupt():
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+        cancellation.install_signal_handlers()
+        with pytest.raises(KeyboardInterrupt):
+            os.kill(os.getpid(), signal.SIGTERM)
+            time.sleep(1)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+def sleep_forever(_):
+    time.sleep(60)
+
+
+def test_terminate_workers_stops_running_tasks():
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=cancellation.init_worker)
+    future = executor.submit(sleep_forever, None)
+    # ワーカーが起動するまで待つ
+    while not executor._processes:
+        time.sleep(0.01)
+    processes = list(executor._processes.values())
+    cancellation.terminate_workers(executor, timeout=5)
+    assert all(not p.is_alive() for p in processes)
+    with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+        future.result(timeout=10)
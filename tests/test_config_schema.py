@@ -0,0 +1,53 @@
+import sys
+import pytest
+import config_schema
+
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'fps': {'type': 'integer', 'minimum': 1, 'maximum': 60},
+        'codec': {'enum': ['libx264', 'libx265']},
+        'items': {'type': 'array', 'items': {'$ref': '#/definitions/item'}},
+    },
+    'required': ['fps'],
+    'additionalProperties': False,
+    'definitions': {
+        'item': {'type': 'object', 'properties': {'name': {'type': 'string'}}, 'required': ['name']},
+    },
+}
+
+
+# jsonschema がインストールされている環境でも簡易検証の動作を確認する
+@pytest.fixture(params=['installed', 'fallback'])
+def validate(request, monkeypatch):
+    if request.param == 'fallback':
+        monkeypatch.setitem(sys.modules, 'jsonschema', None)
+    return config_schema.validate
+
+
+def test_valid_data(validate):
+    assert validate({'fps': 7, 'codec': 'libx264', 'items': [{'name': 'a'}]}, SCHEMA) == []
+
+
+def test_invalid_data(validate):
+    errors = validate({'fps': 0, 'codec': 'h264', 'items': [{}], 'extra': 1}, SCHEMA)
+    assert len(errors) == 4
+    assert validate({'fps': True}, SCHEMA)
+    assert validate({}, SCHEMA)
+
+
+def test_definition(validate):
+    assert validate({'name': 'a'}, SCHEMA, definition='item') == []
+    assert validate({'name': 1}, SCHEMA, definition='item')
+
+
+def test_repository_schema_accepts_batch_file():
+    schema = config_schema.load_schema()
+    batch = {
+        'workers': 2,
+        'defaults': {'iterations': 200, 'caption': True},
+        'jobs': [{'name': 'a', 'input_dir': 'input', 'ref': 'input/a.fits', 'aligned_dir': 'aligned'}],
+    }
+    assert config_schema.validate(batch, schema, definition='batch') == []
+    assert config_schema.validate({'jobs': [], 'unknown': 1}, schema, definition='batch')
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import displacement_store
+
+
+def smooth_field(height=40, width=60):
+    yy, xx = np.mgrid[0:height, 0:width]
+    return np.stack([np.sin(xx / 15.0) * 2, np.cos(yy / 10.0)], axis=-1)
+
+
+def test_field_path():
+    assert displacement_store.field_path('fields', '/data/input/Image01.fits').endswith('Image01.npz')
+
+
+def test_round_trip_full_resolution(tmp_path):
+    field = smooth_field()
+    path = str(tmp_path / 'a.npz')
+    displacement_store.save_field(path, field, dtype='float32', reference='ref.fits')
+    loaded, reference = displacement_store.load_field(path)
+    assert reference == 'ref.fits'
+    assert loaded.shape == field.shape
+    np.testing.assert_allclose(loaded, field, atol=1e-6)
+
+
+def test_round_trip_downscaled(tmp_path):
+    field = smooth_field()
+    path = str(tmp_path / 'a.npz')
+    displacement_store.save_field(path, field, scale=2, dtype='float16')
+    stored = displacement_store.read_field(path)
+    assert stored['field'].shape == (20, 30, 2)
+    assert stored['shape'] == (40, 60) and stored['scale'] == 2 and stored['dtype'] == 'float16'
+    loaded, _ = displacement_store.load_field(path, order=3)
+    assert loaded.shape == field.shape
+    assert np.abs(loaded - field).max() < 0.1
+
+
+def test_write_field_leaves_no_temporary_file(tmp_path):
+    path = str(tmp_path / 'a.npz')
+    displacement_store.write_field(path, np.zeros((4, 4, 2)), (4, 4))
+    assert [p.name for p in tmp_path.iterdir()] == ['a.npz']
+
+
+@pytest.mark.parametrize('order', [1, 3])
+def test_constant_field_is_preserved(tmp_path, order):
+    field = np.full((30, 50, 2), 1.5)
+    path = str(tmp_path / 'a.npz')
+    displacement_store.save_field(path, field, scale=3)
+    loaded, _ = displacement_store.load_field(path, order=order)
+    np.testing.assert_allclose(loaded, field, atol=1e-3)
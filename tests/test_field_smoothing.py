@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import displacement_store
+import field_smoothing
+
+
+def write_sequence(tmp_path, values, shape=(6, 8)):
+    paths = []
+    for i, value in enumerate(values):
+        path = str(tmp_path / f'f{i}.npz')
+        displacement_store.write_field(path, np.full(shape + (2,), value), shape, dtype='float32', reference='ref.fits')
+        paths.append(path)
+    return paths
+
+
+def test_gaussian_weights():
+    weights = field_smoothing.gaussian_weights(1.0)
+    assert len(weights) == 2 * field_smoothing.window_radius(1.0) + 1 == 7
+    assert weights[3] == 1 and weights[2] == weights[4] == pytest.approx(np.exp(-0.5))
+    assert list(field_smoothing.gaussian_weights(0)) == [1.0]
+
+
+def test_split_runs():
+    assert field_smoothing.split_runs([0, 1, 2, 3, 5, 6, 9], 2) == [[0, 1, 2, 3], [5, 6], [9]]
+    assert field_smoothing.split_runs([0, 1, 2, 3, 4, 5, 6, 7], 4) == [[0, 1], [2, 3], [4, 5], [6, 7]]
+
+
+def test_smooth_fields_weighted_average(tmp_path):
+    values = [0.0, 10.0, 0.0, 10.0, 0.0]
+    paths = write_sequence(tmp_path, values)
+    out_paths = [p.replace('.npz', '_s.npz') for p in paths]
+    field_smoothing.smooth_fields(paths, out_paths, [0, 1, 2, 3, 4], 1.0)
+    weights = field_smoothing.gaussian_weights(1.0)
+    for center in range(5):
+        # 系列の端では窓に含まれるフレームのみで正規化する
+        indexes = [i for i in range(center - 3, center + 4) if 0 <= i < 5]
+        w = np.array([weights[i - center + 3] for i in indexes])
+        expected = np.dot(w, [values[i] for i in indexes]) / w.sum()
+        stored = displacement_store.read_field(out_paths[center])
+        assert stored['reference'] == 'ref.fits' and stored['dtype'] == 'float32'
+        np.testing.assert_allclose(stored['field'], expected, rtol=1e-5)
+
+
+def test_smooth_fields_only_writes_requested_frames(tmp_path):
+    paths = write_sequence(tmp_path, [1.0, 2.0, 3.0, 4.0])
+    out_paths = [p.replace('.npz', '_s.npz') for p in paths]
+    assert field_smoothing.smooth_fields(paths, out_paths, [2], 0.5) == 1
+    assert [p.name for p in sorted(tmp_path.glob('*_s.npz'))] == ['f2_s.npz']
+
+
+def test_smooth_fields_rejects_mismatched_fields(tmp_path):
+    paths = write_sequence(tmp_path, [1.0, 2.0])
+    displacement_store.write_field(paths[1], np.zeros((3, 4, 2)), (3, 4))
+    with pytest.raises(ValueError):
+        field_smoothing.smooth_fields(paths, [p + '.out' for p in paths], [0, 1], 1.0)
@@ -0,0 +1,71 @@
+import os
+import datetime
+import numpy as np
+import cv2
+from astropy.io import fits
+import fits_index
+
+
+def write_fits(path, width=8, height=6, date_obs=None):
+    hdu = fits.PrimaryHDU(np.zeros((height, width), dtype=np.float32))
+    if date_obs:
+        hdu.header['DATE-OBS'] = date_obs
+    hdu.writeto(path)
+
+
+def test_parse_date_obs():
+    assert fits_index.parse_date_obs('2025-07-29T05:00:00') == datetime.datetime(2025, 7, 29, 5)
+    # タイムゾーン付きは UTC に変換する
+    assert fits_index.parse_date_obs('2025-07-29T14:00:00+09:00') == datetime.datetime(2025, 7, 29, 5)
+    assert fits_index.parse_date_obs('') is None
+    assert fits_index.parse_date_obs('not a date') is None
+
+
+def test_read_image_info(tmp_path):
+    write_fits(tmp_path / 'a.fits', 8, 6, '2025-07-29T05:00:00')
+    cv2.imwrite(str(tmp_path / 'b.png'), np.zeros((5, 7), dtype=np.uint8))
+    assert fits_index.read_image_info(str(tmp_path / 'a.fits')) == {
+        'width': 8, 'height': 6, 'date_obs': '2025-07-29T05:00:00'}
+    assert fits_index.read_image_info(str(tmp_path / 'b.png')) == {'width': 7, 'height': 5, 'date_obs': None}
+
+
+def test_scan_directory_uses_index(tmp_path, monkeypatch):
+    write_fits(tmp_path / 'a.fits')
+    write_fits(tmp_path / 'b.fits')
+    (tmp_path / 'notes.txt').write_text('x')
+    infos = fits_index.scan_directory(str(tmp_path))
+    assert [i['name'] for i in infos] == ['a.fits', 'b.fits']
+    assert os.path.exists(tmp_path / fits_index.INDEX_FILE)
+
+    # 変更のないファイルはヘッダーを読み直さない
+    def fail(path):
+        raise AssertionError(path)
+
+    monkeypatch.setattr(fits_index, 'read_image_info', fail)
+    assert [i['name'] for i in fits_index.scan_directory(str(tmp_path))] == ['a.fits', 'b.fits']
+
+
+def test_scan_directory_rereads_changed_files(tmp_path):
+    write_fits(tmp_path / 'a.fits', 8, 6)
+    fits_index.scan_directory(str(tmp_path))
+    os.remove(tmp_path / 'a.fits')
+    write_fits(tmp_path / 'a.fits', 10, 6)
+    os.utime(tmp_path / 'a.fits', (0, 12345))
+    assert fits_index.scan_directory(str(tmp_path))[0]['width'] == 10
+
+
+def test_sort_and_filter_frames():
+    infos = [
+        {'name': 'c.fits', 'date_obs': '2025-07-29T05:00:00'},
+        {'name': 'a.fits', 'date_obs': None},
+        {'name': 'b.fits', 'date_obs': '2025-07-29T04:00:00'},
+    ]
+    assert [i['name'] for i in fits_index.sort_frames(infos)] == ['b.fits', 'c.fits', 'a.fits']
+    assert [i['name'] for i in fits_index.sort_frames(infos, sort_by='name')] == ['a.fits', 'b.fits', 'c.fits']
+    window = fits_index.filter_time_window(infos, start=datetime.datetime(2025, 7, 29, 4, 30))
+    assert [i['name'] for i in window] == ['c.fits']
+
+
+def test_find_size_mismatches():
+    infos = [{'name': 'a', 'width': 8, 'height': 6}, {'name': 'b', 'width': 8, 'height': 8}]
+    assert [i['name'] for i in fits_index.find_size_mismatches(infos, 8, 6)] == ['b']
@@ -0,0 +1,81 @@
+import csv
+import numpy as np
+import cv2
+import pytest
+import frame_quality
+
+
+def disk_image(path, width=200, height=160, cx=100, cy=80, radius=50, blur=0):
+    yy, xx = np.mgrid[0:height, 0:width]
+    # 表面の模様（鮮鋭度の評価用）
+    texture = 180 + 40 * np.sign(np.sin(xx / 3.0) * np.sin(yy / 3.0))
+    img = np.where((xx - cx) ** 2 + (yy - cy) ** 2 < radius ** 2, texture, 0).astype(np.uint8)
+    if blur:
+        img = cv2.GaussianBlur(img, (0, 0), blur)
+    cv2.imwrite(str(path), img)
+    return str(path)
+
+
+def test_compute_frame_quality_detects_disk(tmp_path):
+    score = frame_quality.compute_frame_quality(disk_image(tmp_path / 'a.png'), scale=0.5)
+    assert score['disk_found']
+    assert score['disk_cx'] == pytest.approx(100, abs=2)
+    assert score['disk_cy'] == pytest.approx(80, abs=2)
+    assert score['disk_radius'] == pytest.approx(50, abs=2)
+    assert score['disk_residual'] < 0.03
+    assert score['roundness'] > 0.95
+
+
+def test_blurred_frame_is_rejected(tmp_path):
+    paths = [disk_image(tmp_path / f'{i}.png') for i in range(3)] + [disk_image(tmp_path / 'blur.png', blur=4)]
+    scores = [frame_quality.compute_frame_quality(p, scale=0.5) for p in paths]
+    frame_quality.evaluate_quality(scores, min_sharpness=0.5)
+    assert [s['file'] for s in scores if s['rejected']] == ['blur.png']
+    assert scores[-1]['reason'] == 'blur'
+    # keep に含まれるフレームは除外しない
+    frame_quality.evaluate_quality(scores, min_sharpness=0.5, keep=('blur.png',))
+    assert not any(s['rejected'] for s in scores)
+
+
+def test_select_reference_prefers_sharp_round_disk():
+    scores = [
+        {'file': 'a', 'disk_found': True, 'sharpness_rel': 1.0, 'roundness': 0.99, 'disk_residual': 0.005, 'rejected': False},
+        {'file': 'b', 'disk_found': True, 'sharpness_rel': 1.2, 'roundness': 0.99, 'disk_residual': 0.002, 'rejected': False},
+        {'file': 'c', 'disk_found': True, 'sharpness_rel': 2.0, 'roundness': 0.99, 'disk_residual': 0.002, 'rejected': True},
+        {'file': 'd', 'disk_found': False, 'rejected': True},
+    ]
+    assert frame_quality.select_reference(scores)['file'] == 'b'
+    assert frame_quality.select_reference([scores[3]]) is None
+
+
+def test_union_disk_box_scales_and_makes_even():
+    scores = [
+        {'disk_found': True, 'disk_bbox': (10, 20, 31, 41), 'width': 100, 'height': 100},
+        {'disk_found': True, 'disk_bbox': (5, 5, 10, 10), 'width': 50, 'height': 50},
+        {'disk_found': False, 'disk_bbox': None, 'width': 100, 'height': 100},
+    ]
+    x0, y0, x1, y1 = frame_quality.union_disk_box(scores, 100, 100, margin=2)
+    assert (x0, y0) == (8, 8)
+    assert x1 >= 43 and y1 >= 63
+    assert (x1 - x0) % 2 == 0 and (y1 - y0) % 2 == 0
+    assert frame_quality.union_disk_box([], 100, 100) is None
+
+
+# --quality_check なしでは除外判定されたフレームも位置合わせされるため、切り抜き範囲に含める
+def test_union_disk_box_includes_rejected_frames(tmp_path):
+    paths = [disk_image(tmp_path / f'{i}.png') for i in range(5)]
+    paths.append(disk_image(tmp_path / 'blur.png', cx=130, blur=4))
+    scores = [frame_quality.compute_frame_quality(p, scale=0.5) for p in paths]
+    frame_quality.evaluate_quality(scores, min_sharpness=0.5)
+    assert scores[-1]['rejected']
+    x0, y0, x1, y1 = frame_quality.union_disk_box(scores, 200, 160)
+    assert x0 <= 52 and x1 >= 178
+    assert (x1 - x0) % 2 == 0 and (y1 - y0) % 2 == 0
+
+
+def test_write_report_uses_union_of_keys(tmp_path):
+    path = str(tmp_path / 'report.csv')
+    frame_quality.write_report(path, [{'a': 1}, {'a': 2, 'b': 3}])
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert rows == [{'a': '1', 'b': ''}, {'a': '2', 'b': '3'}]
@@ -0,0 +1,64 @@
+import argparse
+import numpy as np
+import cv2
+import pytest
+import generate_movie
+
+
+def test_build_ffmpeg_command_single_output():
+    cmd = generate_movie.build_ffmpeg_command('frames/frame_%04d.png', 7, [{'file': 'out.mp4', 'fps': 7, 'crf': 20}])
+    assert cmd[:6] == ['ffmpeg', '-y', '-framerate', '7', '-i', 'frames/frame_%04d.png']
+    assert cmd[cmd.index('-crf') + 1] == '20'
+    assert '-filter_complex' not in cmd
+    assert cmd[-1] == 'out.mp4'
+
+
+def test_build_ffmpeg_command_renditions():
+    outputs = [{'file': 'out.mp4', 'fps': 7, 'crf': 23}, {'file': 'small.mp4', 'height': 720, 'fps': 14, 'codec': 'libx265'}]
+    cmd = generate_movie.build_ffmpeg_command('frame_%04d.png', 7, outputs)
+    graph = cmd[cmd.index('-filter_complex') + 1]
+    assert graph.startswith('[0:v]split=2[s0][s1]')
+    assert 'scale=-2:720' in graph
+    assert cmd.count('-map') == 2
+    small = cmd[cmd.index('[v1]'):]
+    assert small[small.index('-r') + 1] == '14'
+    assert small[small.index('-c:v') + 1] == 'libx265'
+    assert small[-1] == 'small.mp4'
+
+
+def test_parse_rendition():
+    assert generate_movie.parse_rendition(['small.mp4', 'height=720', 'crf=28']) == {
+        'file': 'small.mp4', 'height': 720, 'crf': 28}
+    with pytest.raises(ValueError):
+        generate_movie.parse_rendition(['small.mp4', 'bitrate=1M'])
+
+
+def test_parse_size():
+    assert generate_movie.parse_size('1920x1080') == (1920, 1080)
+    with pytest.raises(argparse.ArgumentTypeError):
+        generate_movie.parse_size('1920')
+
+
+def test_caption_text():
+    assert generate_movie.caption_text('/data/2025-07-29_05-00-00.fits') == '2025-07-29_05-00-00.fits'
+    assert generate_movie.caption_text('2025-07-29_05-00-00.fits', (r'(\d+)-(\d+)-(\d+)_.*', r'\1/\2/\3')) == '2025/07/29'
+
+
+def test_fit_to_canvas_keeps_aspect_ratio():
+    frame = np.full((100, 200), 255, dtype=np.uint8)
+    canvas = generate_movie.fit_to_canvas(frame, (400, 400))
+    assert canvas.shape == (400, 400)
+    rows = np.where(canvas[:, 200] > 0)[0]
+    assert (rows.min(), rows.max()) == (100, 299)
+
+
+def test_layers_apply_mask(tmp_path):
+    mask = np.zeros((10, 10), dtype=np.uint8)
+    mask[:, 5:] = 255
+    cv2.imwrite(str(tmp_path / 'mask.png'), mask)
+    _, alpha = generate_movie.read_layer(str(tmp_path / 'mask.png'))
+    frame = np.full((10, 10), 200, dtype=np.uint8)
+    layers = generate_movie.build_layers(frame.shape, [alpha], [])
+    result = generate_movie.apply_layers(frame, layers)
+    assert result[:, :5].max() == 0
+    assert result[:, 5:].min() > 0
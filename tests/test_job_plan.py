@@ -0,0 +1,89 @@
+import os
+import argparse
+import pytest
+import job_plan
+
+
+def make_args(tmp_path, **overrides):
+    ref = tmp_path / 'ref.fits'
+    ref.write_bytes(b'reference')
+    values = {key: None for key in job_plan.PLAN_PARAMS + job_plan.MOVIE_PARAMS}
+    values.update(ref=str(ref), aligned_dir=str(tmp_path / 'aligned'), iterations=100, stddev=4.0)
+    values.update(overrides)
+    return argparse.Namespace(**values)
+
+
+def test_parse_shard():
+    assert job_plan.parse_shard('1/3') == (1, 3)
+    for text in ('3/3', '-1/2', '1', 'a/b'):
+        with pytest.raises(ValueError):
+            job_plan.parse_shard(text)
+
+
+def test_shard_frames_cover_all_frames():
+    frames = [f'f{i}' for i in range(10)]
+    shards = [job_plan.shard_frames(frames, i, 3) for i in range(3)]
+    assert sorted(sum(shards, [])) == sorted(frames)
+    assert shards[0] == ['f0', 'f3', 'f6', 'f9']
+
+
+def test_plan_round_trip(tmp_path):
+    args = make_args(tmp_path)
+    frames = [str(tmp_path / 'a.fits'), str(tmp_path / 'b.fits')]
+    plan = job_plan.write_plan(str(tmp_path / 'plan.json'), args, frames)
+    loaded = job_plan.load_plan(str(tmp_path / 'plan.json'))
+    assert loaded['plan_id'] == plan['plan_id'] == job_plan.plan_id(loaded)
+    assert loaded['reference']['sha256'] == job_plan.file_sha256(args.ref)
+
+    target = make_args(tmp_path, iterations=1, movie='override.mp4')
+    job_plan.apply_plan(loaded, target)
+    assert target.iterations == 100
+    assert target.movie == 'override.mp4'
+    assert target.plan_id == plan['plan_id']
+
+
+# マージは別の作業フォルダーから実行されるため、動画の出力先も絶対パスで保存する
+def test_plan_stores_absolute_movie_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = make_args(tmp_path, movie='out/movie.mp4', mask=['mask.png'])
+    plan = job_plan.write_plan(str(tmp_path / 'plan.json'), args, [str(tmp_path / 'a.fits')])
+    assert plan['movie_params']['movie'] == str(tmp_path / 'out' / 'movie.mp4')
+    assert plan['movie_params']['mask'] == [str(tmp_path / 'mask.png')]
+
+
+def test_load_plan_detects_modification(tmp_path):
+    path = tmp_path / 'plan.json'
+    job_plan.write_plan(str(path), make_args(tmp_path), [str(tmp_path / 'a.fits')])
+    path.write_text(path.read_text(encoding='utf-8').replace('"iterations": 100', '"iterations": 10'), encoding='utf-8')
+    with pytest.raises(ValueError):
+        job_plan.load_plan(str(path))
+
+
+def test_frame_status_and_verify_plan(tmp_path):
+    args = make_args(tmp_path)
+    frame = str(tmp_path / 'a.fits')
+    plan = job_plan.write_plan(str(tmp_path / 'plan.json'), args, [frame])
+    assert job_plan.verify_plan(plan) == [(frame, 'missing')]
+
+    os.makedirs(args.aligned_dir)
+    meta = {'frame': 'a.fits', 'output': 'a.fits', 'plan_id': plan['plan_id'],
+            'reference_sha256': plan['reference']['sha256'], 'params': {'iterations': 100}}
+    job_plan.write_frame_meta(args.aligned_dir, frame, meta)
+    assert job_plan.verify_plan(plan) == [(frame, 'output_missing')]
+
+    (tmp_path / 'aligned' / 'a.fits').write_bytes(b'')
+    assert job_plan.verify_plan(plan) == []
+    sha = plan['reference']['sha256']
+    assert job_plan.frame_status(args.aligned_dir, frame, sha, plan_id=None) == 'plan_mismatch'
+    assert job_plan.frame_status(args.aligned_dir, frame, 'other', plan_id=plan['plan_id']) == 'reference_mismatch'
+    assert job_plan.frame_status(args.aligned_dir, frame, sha, plan_id=plan['plan_id'],
+                                 params={'iterations': 50}) == 'params_mismatch'
+
+
+def test_meta_report_row():
+    meta = {'frame': 'a.fits', 'output': 'a.fits', 'elapsed': 1.5,
+            'displacement': {'mean': 0.1, 'max': 0.5}, 'metrics': {'ncc': 0.9},
+            'timings': {'registration': 1.0}}
+    assert job_plan.meta_report_row(meta) == {
+        'frame': 'a.fits', 'output': 'a.fits', 'elapsed': 1.5, 'displacement_mean': 0.1,
+        'displacement_max': 0.5, 'ncc': 0.9, 'time_registration': 1.0}
@@ -0,0 +1,87 @@
+import os
+import time
+import concurrent.futures
+import numpy as np
+import pytest
+import memory_budget
+
+# RSS の取得は Linux のみ
+linux_only = pytest.mark.skipif(memory_budget.process_rss(os.getpid()) is None, reason='RSS を取得できません')
+
+
+def square(x):
+    return x * x
+
+
+# 開始・終了時刻を返すタスク（同時に実行されたかを確認する）
+def sleep_task(seconds):
+    start = time.monotonic()
+    time.sleep(seconds)
+    return start, time.monotonic()
+
+
+# 作業メモリを確保して保持するタスク
+def hold_memory(size_bytes, seconds):
+    data = np.ones(size_bytes // 8)
+    time.sleep(seconds)
+    return float(data[0])
+
+
+def test_estimate_frame_bytes():
+    single = memory_budget.estimate_frame_bytes(100, 100)
+    assert single == 100 * 100 * memory_budget.BYTES_PER_PIXEL + memory_budget.WORKER_OVERHEAD
+    assert memory_budget.estimate_frame_bytes(100, 100, multiscale=True) > single
+
+
+def test_memory_budget():
+    assert memory_budget.memory_budget(2) == 2 * 1024 ** 3
+
+
+def test_max_concurrency():
+    assert memory_budget.max_concurrency(8, 100, None) == 8
+    assert memory_budget.max_concurrency(8, 100, 350) == 3
+    # 予算が1フレームに満たない場合も1つずつは処理する
+    assert memory_budget.max_concurrency(8, 100, 50) == 1
+
+
+def test_run_scheduled_keeps_order_and_reports_progress():
+    done = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        results = memory_budget.run_scheduled(
+            executor, square, list(range(10)), max_inflight=2, frame_bytes=1, budget=None,
+            poll_interval=0.01, on_done=lambda index, result: done.append((index, result)))
+    assert results == [x * x for x in range(10)]
+    assert sorted(done) == [(x, x * x) for x in range(10)]
+
+
+# 待機中のワーカーの RSS（親プロセスと共有するページ）は予算に含めない
+@linux_only
+def test_run_scheduled_ignores_idle_worker_rss():
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        idle = memory_budget.workers_rss(executor, {})
+        list(executor.map(sleep_task, [0] * 4))
+        assert sum(memory_budget.process_rss(pid) for pid in executor._processes) > 4 * 1024 ** 2
+        # 予算はタスク4つ分のみ（待機中のワーカーの RSS の合計よりも小さい）
+        results = memory_budget.run_scheduled(
+            executor, sleep_task, [0.5] * 4, max_inflight=4, frame_bytes=1024 ** 2,
+            budget=4 * 1024 ** 2, poll_interval=0.01)
+    assert idle == 0
+    # 4つのタスクが同時に実行されている
+    assert max(start for start, _ in results) < min(end for _, end in results)
+
+
+# ワーカーが確保した作業メモリは RSS の増加量として検出する
+@linux_only
+def test_workers_rss_measures_growth():
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        list(executor.map(sleep_task, [0] * 2))
+        baseline = {}
+        assert memory_budget.workers_rss(executor, baseline) == 0
+        future = executor.submit(hold_memory, 64 * 1024 ** 2, 2.0)
+        deadline = time.monotonic() + 5
+        growth = 0
+        while time.monotonic() < deadline and growth < 48 * 1024 ** 2:
+            growth = memory_budget.workers_rss(executor, baseline)
+            time.sleep(0.05)
+        future.result()
+    assert growth >= 48 * 1024 ** 2
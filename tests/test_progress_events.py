@@ -0,0 +1,42 @@
+import json
+import pytest
+import progress_events
+
+
+def test_emit_and_parse(capsys):
+    progress_events.emit('frame_finished', frame='a.fits', elapsed=1.5)
+    line = capsys.readouterr().out
+    assert line.count('\n') == 1
+    record = progress_events.parse_event(line)
+    assert record['event'] == 'frame_finished' and record['frame'] == 'a.fits'
+    assert 'time' in record
+
+
+def test_parse_event_ignores_other_lines():
+    assert progress_events.parse_event('処理中: a.fits') is None
+    assert progress_events.parse_event('{broken') is None
+    assert progress_events.parse_event(json.dumps({'frame': 'a'})) is None
+    assert progress_events.parse_event(json.dumps([1, 2])) is None
+
+
+def test_tracker_counts_throughput_and_eta():
+    tracker = progress_events.ProgressTracker()
+    tracker.update({'event': 'run_started', 'total': 5, 'time': 100.0})
+    tracker.update({'event': 'stage', 'name': 'registration', 'time': 100.0})
+    assert tracker.throughput() is None and tracker.eta() is None
+    for i, name in enumerate(['a', 'b', 'c']):
+        tracker.update({'event': 'frame_started', 'frame': name, 'time': 100.0 + 2 * i})
+        tracker.update({'event': 'frame_finished', 'frame': name, 'time': 102.0 + 2 * i})
+    tracker.update({'event': 'frame_failed', 'frame': 'd', 'time': 107.0})
+    assert tracker.done == 3 and tracker.failed == 1 and not tracker.running
+    assert tracker.stage == 'registration'
+    assert tracker.throughput() == pytest.approx(0.5)
+    assert tracker.eta() == pytest.approx(2.0)
+    assert tracker.fraction() == pytest.approx(0.8)
+    tracker.update({'event': 'run_finished', 'time': 110.0})
+    assert tracker.stage == 'finished'
+
+
+def test_format_duration():
+    assert progress_events.format_duration(None) == '--:--:--'
+    assert progress_events.format_duration(3725.4) == '1:02:05'
@@ -0,0 +1,168 @@
+import os
+import csv
+import json
+import glob
+import numpy as np
+import cv2
+import pytest
+from conftest import run_script, parse_events, probe_video
+import frame_quality
+import generate_movie
+import job_plan
+
+# samples/10_simple の位置合わせの設定（exec_オプション別demonsの処理時間比較.ps1 より反復回数を減らしたもの）
+SIMPLE_OPTIONS = ['--ref', 'Image01.fits', '--iterations', '20', '--stddev', '4.0', '--workers', '1']
+SIMPLE_FRAMES = ['Image01.fits', 'Image02.fits', 'Image03.fits', 'Image04.fits', 'Image05.fits']
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+GOLDEN_IMAGES = os.path.join(GOLDEN_DIR, '10_simple.npz')
+GOLDEN_METRICS = os.path.join(GOLDEN_DIR, '10_simple.json')
+
+# ゴールデンデータとの比較に使用する縮小画像のサイズ
+THUMBNAIL_SIZE = (100, 100)
+# 縮小画像（0-1 に正規化）の平均絶対誤差と最大絶対誤差の許容値
+# 同じ環境では出力は一致する。許容値は浮動小数点演算の環境差を吸収しつつ、反復回数を 20 から 5 に減らした程度の差は検出できる値
+IMAGE_MEAN_TOLERANCE = 1e-4
+IMAGE_MAX_TOLERANCE = 0.01
+# 品質指標・変位量の許容誤差（絶対値）
+METRIC_TOLERANCE = {'ncc': 1e-3, 'ncc_before': 1e-4, 'mse': 5e-5, 'displacement_mean': 2e-3, 'displacement_max': 0.05}
+
+# 1フレームあたりの処理段階ごとの時間の上限（秒、802x802 画素・反復 20 回）
+# 遅いマシンでは --timing-scale で緩める
+TIMING_BUDGETS = {
+    'load': 1.0,
+    'histogram': 1.0,
+    'registration': 10.0,
+    'resample': 1.0,
+    'metrics': 1.0,
+    'save': 1.0,
+}
+
+
+# samples/10_simple を一度だけ位置合わせし、各テストで結果を共有する
+@pytest.fixture(scope='module')
+def simple_run(simple_input):
+    aligned_dir = os.path.join(os.path.dirname(simple_input), 'aligned')
+    result = run_script('make_timelapse.py', '--input_dir', '.', '--aligned_dir', aligned_dir,
+                        '--progress_events', *SIMPLE_OPTIONS, cwd=simple_input)
+    metas = {name: job_plan.read_frame_meta(aligned_dir, name) for name in SIMPLE_FRAMES}
+    return {'input_dir': simple_input, 'aligned_dir': aligned_dir, 'stdout': result.stdout, 'metas': metas}
+
+
+# 位置合わせ後の画像を 0-1 に正規化した縮小画像にする関数
+def thumbnail(path):
+    return cv2.resize(frame_quality.read_gray_float32(path), THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def frame_values(meta):
+    return {
+        'ncc': meta['metrics']['ncc'],
+        'ncc_before': meta['metrics']['ncc_before'],
+        'mse': meta['metrics']['mse'],
+        'displacement_mean': meta['displacement']['mean'],
+        'displacement_max': meta['displacement']['max'],
+    }
+
+
+def test_outputs_match_golden(simple_run, update_golden):
+    thumbnails = {}
+    for name in SIMPLE_FRAMES:
+        output = os.path.join(simple_run['aligned_dir'], name)
+        assert os.path.exists(output)
+        thumbnails[name] = thumbnail(output)
+    values = {name: frame_values(simple_run['metas'][name]) for name in SIMPLE_FRAMES}
+
+    if update_golden or not os.path.exists(GOLDEN_IMAGES):
+        if not update_golden:
+            pytest.skip('ゴールデンデータがありません（--update-golden で作成）')
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        np.savez_compressed(GOLDEN_IMAGES, **{name: img.astype(np.float32) for name, img in thumbnails.items()})
+        with open(GOLDEN_METRICS, 'w', encoding='utf-8') as f:
+            json.dump({'options': SIMPLE_OPTIONS, 'frames': values}, f, indent=2)
+        return
+
+    with np.load(GOLDEN_IMAGES) as golden_images, open(GOLDEN_METRICS, 'r', encoding='utf-8') as f:
+        golden = json.load(f)
+        assert golden['options'] == SIMPLE_OPTIONS, 'ゴールデンデータの設定が異なります（--update-golden で更新）'
+        for name in SIMPLE_FRAMES:
+            diff = np.abs(thumbnails[name] - golden_images[name])
+            assert diff.mean() < IMAGE_MEAN_TOLERANCE, name
+            assert diff.max() < IMAGE_MAX_TOLERANCE, name
+            for key, tolerance in METRIC_TOLERANCE.items():
+                assert values[name][key] == pytest.approx(golden['frames'][name][key], abs=tolerance), (name, key)
+
+
+def test_outputs_have_reference_size(simple_run):
+    for name in SIMPLE_FRAMES:
+        img = frame_quality.read_gray_float32(os.path.join(simple_run['aligned_dir'], name))
+        assert img.shape == (802, 802)
+
+
+def test_reference_frame_is_unchanged(simple_run):
+    meta = simple_run['metas']['Image01.fits']
+    assert meta['displacement']['max'] == pytest.approx(0, abs=1e-6)
+    assert meta['metrics']['ncc'] == pytest.approx(1, abs=1e-6)
+
+
+def test_stage_timings_within_budget(simple_run, timing_scale):
+    for name, meta in simple_run['metas'].items():
+        assert set(meta['timings']) == set(TIMING_BUDGETS)
+        for stage, budget in TIMING_BUDGETS.items():
+            assert meta['timings'][stage] < budget * timing_scale, f"{name}: {stage} {meta['timings'][stage]:.3f} 秒"
+
+
+def test_progress_events(simple_run):
+    events = parse_events(simple_run['stdout'])
+    started = [e for e in events if e['event'] == 'run_started']
+    assert len(started) == 1 and started[0]['total'] == len(SIMPLE_FRAMES)
+    finished = [e['frame'] for e in events if e['event'] == 'frame_finished']
+    assert sorted(finished) == SIMPLE_FRAMES
+    assert not [e for e in events if e['event'] == 'frame_failed']
+    assert events[-1]['event'] == 'run_finished'
+
+
+def test_registration_report(simple_run):
+    with open(os.path.join(simple_run['aligned_dir'], 'registration_report.csv'), newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['frame'] for row in rows] == SIMPLE_FRAMES
+    for row in rows:
+        assert float(row['ncc']) == pytest.approx(simple_run['metas'][row['frame']]['metrics']['ncc'])
+
+
+def test_resume_skips_processed_frames(simple_run):
+    result = run_script('make_timelapse.py', '--input_dir', '.', '--aligned_dir', simple_run['aligned_dir'],
+                        '--resume', '--progress_events', *SIMPLE_OPTIONS, cwd=simple_run['input_dir'])
+    events = parse_events(result.stdout)
+    assert [e['total'] for e in events if e['event'] == 'run_started'] == [0]
+    assert not glob.glob(os.path.join(simple_run['aligned_dir'], '.partial', '*'))
+
+
+# 動画に渡すフレームの準備（ffmpeg の実行前まで）を確認する
+def test_movie_frames_prepared(simple_run, tmp_path, monkeypatch):
+    commands = []
+
+    def capture(cmd, outputs=()):
+        frames = sorted(glob.glob(os.path.join(os.path.dirname(cmd[cmd.index('-i') + 1]), 'frame_*.png')))
+        commands.append((cmd, [cv2.imread(f, cv2.IMREAD_UNCHANGED).shape for f in frames]))
+
+    monkeypatch.setattr(generate_movie.cancellation, 'run_process', capture)
+    generate_movie.create_video_with_ffmpeg(
+        simple_run['aligned_dir'], str(tmp_path / 'simple.mp4'), caption=True, canvas=(320, 240))
+    (cmd, shapes), = commands
+    assert cmd[-1] == str(tmp_path / 'simple.mp4')
+    assert shapes == [(240, 320)] * len(SIMPLE_FRAMES)
+
+
+def test_movie_frame_count_and_size(simple_run, tmp_path, ffmpeg):
+    movie = tmp_path / 'simple.mp4'
+    small = tmp_path / 'simple_small.mp4'
+    run_script('generate_movie.py', simple_run['aligned_dir'], movie, '--fps', 7, '--caption',
+               '--rendition', small, 'height=200')
+    assert probe_video(str(movie)) == (len(SIMPLE_FRAMES), 802, 802)
+    assert probe_video(str(small)) == (len(SIMPLE_FRAMES), 200, 200)
+
+
+def test_movie_canvas_size(simple_run, tmp_path, ffmpeg):
+    movie = tmp_path / 'simple_canvas.mp4'
+    run_script('generate_movie.py', simple_run['aligned_dir'], movie, '--canvas', '640x360')
+    assert probe_video(str(movie)) == (len(SIMPLE_FRAMES), 640, 360)
@@ -0,0 +1,193 @@
+import os
+import csv
+import json
+import numpy as np
+import pytest
+from conftest import run_script, parse_events, probe_video
+import displacement_store
+import frame_quality
+import job_plan
+
+SYNTHETIC_OPTIONS = ['--iterations', '50', '--workers', '1']
+
+
+# 合成画像の系列を位置合わせし、変位場も保存する
+@pytest.fixture(scope='module')
+def synthetic_run(synthetic_frames, tmp_path_factory):
+    work_dir = str(tmp_path_factory.mktemp('synthetic_run'))
+    aligned_dir = os.path.join(work_dir, 'aligned')
+    field_dir = os.path.join(work_dir, 'fields')
+    result = run_script('make_timelapse.py', '--ref', synthetic_frames[0],
+                        '--input_dir', os.path.dirname(synthetic_frames[0]), '--aligned_dir', aligned_dir,
+                        '--field_dir', field_dir, '--field_dtype', 'float32', '--progress_events',
+                        *SYNTHETIC_OPTIONS)
+    return {'work_dir': work_dir, 'aligned_dir': aligned_dir, 'field_dir': field_dir, 'stdout': result.stdout}
+
+
+def read_report(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def rewarp(synthetic_frames, synthetic_run, aligned_dir, *options):
+    return run_script('make_timelapse.py', '--ref', synthetic_frames[0],
+                      '--input_dir', os.path.dirname(synthetic_frames[0]), '--aligned_dir', aligned_dir,
+                      '--field_dir', synthetic_run['field_dir'], '--rewarp', *options, *SYNTHETIC_OPTIONS)
+
+
+# フレーム間の変位場の変化量（時間方向の揺らぎ）の合計
+def temporal_jitter(fields):
+    return sum(float(np.mean(np.abs(b - a))) for a, b in zip(fields, fields[1:]))
+
+
+def test_frames_sorted_by_date_obs(synthetic_run, synthetic_frames):
+    rows = read_report(os.path.join(synthetic_run['aligned_dir'], 'registration_report.csv'))
+    assert [row['frame'] for row in rows] == [os.path.basename(f) for f in synthetic_frames]
+
+
+def test_registration_improves_alignment(synthetic_run, synthetic_frames):
+    for f in synthetic_frames[1:]:
+        metrics = job_plan.read_frame_meta(synthetic_run['aligned_dir'], f)['metrics']
+        assert metrics['ncc'] > metrics['ncc_before']
+        assert metrics['mse'] < metrics['mse_before']
+        assert metrics['folding'] == 0
+
+
+def test_rewarp_reproduces_registration(synthetic_run, synthetic_frames):
+    aligned_dir = os.path.join(synthetic_run['work_dir'], 'rewarp')
+    rewarp(synthetic_frames, synthetic_run, aligned_dir)
+    for f in synthetic_frames:
+        name = os.path.basename(f)
+        original = frame_quality.read_gray_float32(os.path.join(synthetic_run['aligned_dir'], name))
+        rewarped = frame_quality.read_gray_float32(os.path.join(aligned_dir, name))
+        assert np.abs(original - rewarped).max() < 1e-3, name
+
+
+def test_temporal_smoothing_reduces_jitter(synthetic_run, synthetic_frames):
+    aligned_dir = os.path.join(synthetic_run['work_dir'], 'smoothed')
+    rewarp(synthetic_frames, synthetic_run, aligned_dir, '--temporal_smooth', '1.0')
+    smoothed_dir = os.path.join(synthetic_run['field_dir'], 'smoothed')
+    raw = [displacement_store.load_field(displacement_store.field_path(synthetic_run['field_dir'], f))[0]
+           for f in synthetic_frames]
+    smoothed = [displacement_store.load_field(displacement_store.field_path(smoothed_dir, f))[0]
+                for f in synthetic_frames]
+    assert temporal_jitter(smoothed) < temporal_jitter(raw)
+    rows = read_report(os.path.join(aligned_dir, 'registration_report.csv'))
+    assert len(rows) == len(synthetic_frames)
+
+
+# プレビューは最後に動画を生成するため ffmpeg が必要
+def test_preview_scales_outputs(synthetic_run, synthetic_frames, ffmpeg):
+    aligned_dir = os.path.join(synthetic_run['work_dir'], 'preview_run')
+    run_script('make_timelapse.py', '--ref', synthetic_frames[0],
+               '--input_dir', os.path.dirname(synthetic_frames[0]), '--aligned_dir', aligned_dir,
+               '--preview', '0.5', '--preview_frames', '3', *SYNTHETIC_OPTIONS)
+    outputs = sorted(n for n in os.listdir(os.path.join(aligned_dir, 'preview')) if n.endswith('.fits'))
+    assert len(outputs) == 3
+    for name in outputs:
+        assert frame_quality.read_gray_float32(os.path.join(aligned_dir, 'preview', name)).shape == (60, 80)
+    assert not [n for n in os.listdir(aligned_dir) if n.endswith('.fits')]
+    assert probe_video(os.path.join(aligned_dir, 'preview', 'preview.mp4')) == (3, 80, 60)
+
+
+def test_auto_reference_and_crop(synthetic_run, synthetic_frames):
+    aligned_dir = os.path.join(synthetic_run['work_dir'], 'auto')
+    run_script('make_timelapse.py', '--auto_ref', '--auto_crop', '--crop_margin', '4',
+               '--input_dir', os.path.dirname(synthetic_frames[0]), '--aligned_dir', aligned_dir,
+               *SYNTHETIC_OPTIONS)
+    meta = job_plan.read_frame_meta(aligned_dir, synthetic_frames[0])
+    x0, y0, x1, y1 = meta['params']['crop']
+    assert (x1 - x0) % 2 == 0 and (y1 - y0) % 2 == 0
+    assert (x1 - x0) < 160 and (y1 - y0) < 120
+    output = frame_quality.read_gray_float32(os.path.join(aligned_dir, meta['output']))
+    assert output.shape == (y1 - y0, x1 - x0)
+    assert os.path.exists(os.path.join(aligned_dir, 'quality_report.csv'))
+
+
+def test_batch_processes_sessions(synthetic_run, synthetic_frames):
+    work_dir = synthetic_run['work_dir']
+    jobs_file = os.path.join(work_dir, 'jobs.json')
+    with open(jobs_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'defaults': {'iterations': 20},
+            'jobs': [
+                {'name': 'synthetic', 'input_dir': os.path.dirname(synthetic_frames[0]),
+                 'aligned_dir': os.path.join(work_dir, 'batch_synthetic'), 'auto_ref': True},
+                {'name': 'by_name', 'input_dir': os.path.dirname(synthetic_frames[0]), 'ref': synthetic_frames[0],
+                 'aligned_dir': os.path.join(work_dir, 'batch_by_name'), 'sort_by': 'name', 'iterations': 10},
+            ],
+        }, f)
+    result = run_script('batch_timelapse.py', jobs_file, '--workers', '1', '--progress_events')
+    events = parse_events(result.stdout)
+    assert sorted(e['session'] for e in events if e['event'] == 'session_finished') == ['by_name', 'synthetic']
+    rows = read_report(os.path.join(work_dir, 'jobs_report.csv'))
+    for session in ('synthetic', 'by_name'):
+        assert sum(row['session'] == session for row in rows) == len(synthetic_frames)
+    by_name = read_report(os.path.join(work_dir, 'batch_by_name', 'registration_report.csv'))
+    assert [row['frame'] for row in by_name] == sorted(os.path.basename(f) for f in synthetic_frames)
+
+
+# 1つのセッションのフレームが壊れていても、他のセッションは最後まで処理する
+def test_batch_isolates_failed_session(synthetic_run, synthetic_frames):
+    work_dir = synthetic_run['work_dir']
+    bad_input = os.path.join(work_dir, 'bad_input')
+    os.makedirs(bad_input)
+    for f in synthetic_frames[:3]:
+        with open(f, 'rb') as src, open(os.path.join(bad_input, os.path.basename(f)), 'wb') as dst:
+            data = src.read()
+            # 最後のフレームは画素データの途中で切れた FITS にする
+            dst.write(data[:len(data) // 2] if f == synthetic_frames[2] else data)
+    jobs_file = os.path.join(work_dir, 'jobs_bad.json')
+    with open(jobs_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'defaults': {'iterations': 10},
+            'jobs': [
+                {'name': 'bad', 'input_dir': bad_input, 'ref': os.path.join(bad_input, os.path.basename(synthetic_frames[0])),
+                 'aligned_dir': os.path.join(work_dir, 'bad_aligned')},
+                {'name': 'good', 'input_dir': os.path.dirname(synthetic_frames[0]), 'ref': synthetic_frames[0],
+                 'aligned_dir': os.path.join(work_dir, 'good_aligned')},
+            ],
+        }, f)
+    result = run_script('batch_timelapse.py', jobs_file, '--workers', '1', check=False)
+    assert result.returncode == 1
+    assert 'bad: error' in result.stdout and 'good: done' in result.stdout
+    rows = read_report(os.path.join(work_dir, 'jobs_bad_report.csv'))
+    failed = [row for row in rows if row['error']]
+    assert [(row['session'], row['frame']) for row in failed] == [('bad', os.path.basename(synthetic_frames[2]))]
+    assert sum(row['session'] == 'good' for row in rows) == len(synthetic_frames)
+    assert len(os.listdir(os.path.join(work_dir, 'good_aligned', 'metadata'))) == len(synthetic_frames)
+
+
+# ジョブプランを作成し、2つのシャードを順に処理する。全シャードが揃うまでマージは失敗する
+# プランは作業フォルダーからの相対パスで作成し、シャードとマージは別の作業フォルダーから実行する
+def test_plan_shards_and_merge(synthetic_run, synthetic_frames, tmp_path):
+    work_dir = synthetic_run['work_dir']
+    plan_file = os.path.join(work_dir, 'plan.json')
+    aligned_dir = os.path.join(work_dir, 'sharded')
+    run_script('make_timelapse.py', '--ref', synthetic_frames[0],
+               '--input_dir', os.path.dirname(synthetic_frames[0]), '--aligned_dir', 'sharded',
+               '--write_plan', 'plan.json', '--mask', 'mask.png', '--overlay', 'overlay.png',
+               '--rendition', 'out/small.mp4', 'height=200', *SYNTHETIC_OPTIONS, cwd=work_dir)
+    plan = job_plan.load_plan(plan_file)
+    assert plan['frames'] == synthetic_frames
+    assert plan['aligned_dir'] == aligned_dir
+    assert plan['movie_params']['mask'] == [os.path.join(work_dir, 'mask.png')]
+    assert plan['movie_params']['overlay'] == [os.path.join(work_dir, 'overlay.png')]
+    assert plan['movie_params']['rendition'] == [[os.path.join(work_dir, 'out', 'small.mp4'), 'height=200']]
+
+    def process(*options, check=True):
+        return run_script('make_timelapse.py', '--plan', plan_file, *options, '--workers', '1',
+                          cwd=str(tmp_path), check=check)
+
+    process('--shard', '0/2')
+    assert len(os.listdir(os.path.join(aligned_dir, 'metadata'))) == len(synthetic_frames[0::2])
+    result = process('--merge', check=False)
+    assert result.returncode == 1
+    assert result.stdout.count('未完了:') == len(synthetic_frames[1::2])
+
+    process('--shard', '1/2')
+    result = process('--merge')
+    assert 'ジョブプランの全フレームの処理完了を確認しました' in result.stdout
+    for f in synthetic_frames:
+        assert os.path.exists(os.path.join(aligned_dir, os.path.basename(f)))
+    assert not os.listdir(str(tmp_path))
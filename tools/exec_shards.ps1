@@ -0,0 +1,74 @@
+<#
+    ジョブプランを分割して並行処理し、マージして動画を生成する検証用スクリプト
+
+    複数のノードでの分散処理を、ローカルの複数プロセスで代用して確認する。
+    各シャードは別プロセス（Start-Job）として起動し、全シャードの終了後にマージする。
+#>
+
+# 分割数（ノード数の代わり）
+$shard_count = 2
+
+# 参照画像のベース名
+$ref_basename = "Image01"
+
+# サンプルフォルダ
+$sample_dir = "samples/10_simple"
+
+$input_dir = "$sample_dir/input"
+$ref = "$input_dir/$ref_basename.fits"
+$aligned_dir = "$sample_dir/aligned_shards"
+$plan = "$sample_dir/plan.json"
+$movie = "$sample_dir/timelapse_shards.mp4"
+
+#
+# ジョブプラン作成
+#
+$plan_cmd = @(
+    "python", "make_timelapse.py",
+    "--ref", $ref,
+    "--input_dir", $input_dir,
+    "--aligned_dir", $aligned_dir,
+    "--movie", $movie,
+    "--iterations", "100",
+    "--stddev", "4.0",
+    "--write_plan", $plan
+)
+
+Write-Host "ジョブプラン作成 実行: $($plan_cmd -join ' ')"
+& $plan_cmd[0] $plan_cmd[1..($plan_cmd.Length - 1)]
+
+#
+# シャードごとの位置合わせ
+#
+$startTime = Get-Date
+Write-Host "位置合わせ 開始時刻: $startTime"
+
+$jobs = 0..($shard_count - 1) | ForEach-Object {
+    $shard = "$_/$shard_count"
+    Write-Host "シャード $shard 起動"
+    Start-Job -WorkingDirectory (Get-Location) -ScriptBlock {
+        param($plan, $shard)
+        python make_timelapse.py --plan $plan --shard $shard --workers 1
+    } -ArgumentList $plan, $shard
+}
+
+$jobs | Wait-Job | Receive-Job
+$jobs | Remove-Job
+
+$endTime = Get-Date
+Write-Host "位置合わせ 終了時刻: $endTime"
+
+$duration = New-TimeSpan -Start $startTime -End $endTime
+Write-Host "位置合わせ 実行時間: $($duration.ToString())"
+
+#
+# マージ（全フレームの完了を検証して動画を生成）
+#
+$merge_cmd = @(
+    "python", "make_timelapse.py",
+    "--plan", $plan,
+    "--merge"
+)
+
+Write-Host "マージ 実行: $($merge_cmd -join ' ')"
+& $merge_cmd[0] $merge_cmd[1..($merge_cmd.Length - 1)]